@@ -0,0 +1,371 @@
+import argparse
+import gc
+import importlib.util
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from cover_images import process_cover, thumbnail_url
+from cover_store import CoverStore
+from facet_index import FacetIndex
+from search_index import SearchIndex
+from shared_library import SharedLibrary
+from sorted_views import SortedViews
+from storage import BACKENDS, open_storage
+from thumbnail_cache import ThumbnailCache
+
+
+REPO_FOLDER = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SIZES = [1000, 10000, 100000]
+DEFAULT_REPEAT = 3
+# Distinct cover images shared by the synthetic books
+COVER_COUNT = 50
+# A run is flagged by --compare when it is this much slower than the baseline
+REGRESSION_RATIO = 1.2
+# Pages opened cold by the startup benchmark: the landing page, a page without charts and the charts page
+STARTUP_PAGES = ["Home", "Search for a Book", "Statistics"]
+# Modules too heavy to load on every cold start, reported per page by the startup benchmark
+HEAVY_MODULES = ["pandas", "plotly.express", "numpy", "PIL.Image"]
+
+# Runs in a fresh interpreter: import time of Streamlit's test runner, then the first render of
+# one page, and the heavy modules the page left loaded. Prints the result as JSON.
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+imported = time.perf_counter()
+app = AppTest.from_file(sys.argv[1], default_timeout=600)
+app.session_state.choice = sys.argv[2]
+app.run()
+rendered = time.perf_counter()
+print(json.dumps({"import": imported - start, "first_render": rendered - imported,
+                  "errors": [str(error.value) for error in app.exception],
+                  "modules": [name for name in sys.argv[3:] if name in sys.modules]}))
+"""
+
+WORDS = ["shadow", "river", "empire", "garden", "winter", "silent", "golden", "night", "storm", "house",
+         "secret", "last", "city", "ocean", "fire", "history", "mind", "habits", "money", "code"]
+GENRES = ["Fiction", "Fantasy", "History", "Science", "Biography", "Poetry", "Self-help", "Mystery", ""]
+
+
+# Synthetic books with realistic repetition: a few thousand authors, a handful of genres.
+# They carry ids and versions like a saved library, so every backend gets the same input.
+def make_books(count, covers, seed=0):
+    rng = random.Random(seed)
+    authors = [f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()}son" for _ in range(max(10, count // 50))]
+    return [
+        {
+            "id": index + 1,
+            "title": " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 5))).title() + f" {index}",
+            "author": rng.choice(authors),
+            "year": rng.randint(1850, 2025),
+            "genre": rng.choice(GENRES),
+            "read": rng.random() < 0.4,
+            "image": rng.choice(covers),
+            "version": 1,
+        }
+        for index in range(count)
+    ]
+
+
+# Small solid-colour PNG covers, stored the way the app stores uploads
+def make_covers(cover_store, count=COVER_COUNT, seed=0):
+    from PIL import Image
+
+    rng = random.Random(seed)
+    covers = []
+    for _ in range(count):
+        image = Image.new("RGB", (600, 900), tuple(rng.randrange(256) for _ in range(3)))
+        path = os.path.join(cover_store.folder, "upload.png")
+        image.save(path)
+        covers.append(cover_store.put_file(path)[0])
+        os.remove(path)
+    return covers
+
+
+# Time fn over several runs, then run it once more under tracemalloc for its peak allocation.
+# setup() runs before each call outside the timing and returns the arguments for fn.
+def measure(fn, repeat, setup=None):
+    runs = []
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        gc.collect()
+        start = time.perf_counter()
+        fn(*args)
+        runs.append(time.perf_counter() - start)
+
+    args = setup() if setup else ()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"seconds": statistics.median(runs), "runs": runs, "peak_bytes": peak}
+
+
+# Highest resident set size of this process so far, None where the OS doesn't report it
+def max_rss_bytes():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def bench_storage(work_folder, books, repeat):
+    results = {}
+    for backend in BACKENDS:
+        data_folder = os.path.join(work_folder, f"data-{backend}")
+        shutil.rmtree(data_folder, ignore_errors=True)
+        os.makedirs(data_folder)
+        storage = open_storage(backend, data_folder)
+
+        # save_library(): the whole library written at once
+        results[f"save.{backend}"] = measure(lambda: storage.save(books), repeat)
+        # load_library(): parse the whole library
+        results[f"load.{backend}"] = measure(storage.load, repeat)
+
+        # One edit, the common write from the Edit page
+        shared_library = SharedLibrary(storage)
+        with shared_library.read():
+            pass
+        book_ids = shared_library.catalog.ids
+        rng = random.Random(1)
+        results[f"update.{backend}"] = measure(
+            lambda book_id: shared_library.update(book_id, {"read": True}), repeat,
+            setup=lambda: (rng.choice(book_ids),)
+        )
+        if hasattr(storage, "close"):
+            storage.close()
+    return results
+
+
+def bench_indexes(books, repeat):
+    results = {}
+    index = SearchIndex()
+    results["search.build"] = measure(lambda: index.rebuild(books), repeat)
+    results["search.substring"] = measure(lambda: index.search("garden", "title"), repeat)
+    results["search.prefix"] = measure(lambda: index.search("Shadow", "author", mode="prefix"), repeat)
+    results["search.fuzzy"] = measure(lambda: index.fuzzy_search("gardn sekret"), repeat)
+
+    views = SortedViews()
+    results["sort.build"] = measure(lambda: views.rebuild(books), repeat)
+    middle = len(books) // 2
+    results["sort.page"] = measure(lambda: views.page("year", middle, 24), repeat)
+
+    facets = FacetIndex()
+    results["facets.build"] = measure(lambda: facets.rebuild(books), repeat)
+    filters = {"genres": ("Fiction", "Fantasy"), "years": (1950, 2000), "read": False}
+    results["facets.counts"] = measure(lambda: facets.counts(**filters), repeat)
+    mask = facets.mask(**filters)
+    # Uncached: the selection cache is emptied before every run
+    results["facets.select"] = measure(lambda: views.select("title", mask), repeat,
+                                       setup=lambda: views._selections.clear() or ())
+    return results
+
+
+def bench_covers(work_folder, covers, repeat):
+    results = {}
+    cache_folder = os.path.join(work_folder, "thumb_cache")
+
+    # Inline data URI for a cover with no thumbnail: cold (read + encode) and from memory
+    results["covers.data_uri_cold"] = measure(
+        lambda cache: cache.get_data_uri(covers[0]), repeat,
+        setup=lambda: (shutil.rmtree(cache_folder, ignore_errors=True) or ThumbnailCache(cache_folder),)
+    )
+    cache = ThumbnailCache(cache_folder)
+    cache.get_data_uri(covers[0])
+    results["covers.data_uri_warm"] = measure(lambda: cache.get_data_uri(covers[0]), repeat)
+
+    results["covers.thumbnails"] = measure(lambda: process_cover(covers[0]), repeat)
+    results["covers.thumbnail_url"] = measure(lambda: thumbnail_url(covers[0]), repeat)
+    return results
+
+
+# Rerun of the Display page, which renders one page of book cards, using Streamlit's
+# headless test runner. The first run loads the library; the rerun is what a click costs.
+def bench_render(work_folder, repeat):
+    try:
+        import streamlit as st
+        from streamlit.testing.v1 import AppTest
+    except ImportError:
+        return {}
+    # Cached resources hold the storage of the previous size's folder
+    st.cache_resource.clear()
+    st.cache_data.clear()
+    app = AppTest.from_file(os.path.join(REPO_FOLDER, "library_manager.py"), default_timeout=600)
+    app.session_state.choice = "Display All Books"
+    start = time.perf_counter()
+    app.run()
+    first_run = time.perf_counter() - start
+    result = measure(app.run, repeat)
+    return {"render.first_run": {"seconds": first_run, "runs": [first_run], "peak_bytes": None},
+            "render.rerun": result}
+
+
+# Cold start of the app as a new worker sees it: each run is a fresh interpreter that imports
+# Streamlit and renders one page, loading the library from disk. startup.import is the Streamlit
+# import alone; startup.<page> is the first render of that page, app imports included.
+def bench_startup(work_folder, repeat, pages=STARTUP_PAGES):
+    if importlib.util.find_spec("streamlit") is None:
+        return {}
+    app_path = os.path.join(REPO_FOLDER, "library_manager.py")
+    # Home shows this banner from the working folder
+    shutil.copy(os.path.join(REPO_FOLDER, "rb_39405.png"), work_folder)
+    results = {}
+    imports = []
+    for page in pages:
+        runs, modules = [], []
+        for _ in range(repeat):
+            output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT, app_path, page, *HEAVY_MODULES],
+                                    capture_output=True, text=True, cwd=work_folder, check=True).stdout
+            run = json.loads(output.strip().splitlines()[-1])
+            if run["errors"]:
+                raise RuntimeError(f"{page} failed to render: {run['errors']}")
+            imports.append(run["import"])
+            runs.append(run["first_render"])
+            modules = run["modules"]
+        results[f"startup.{page}"] = {"seconds": statistics.median(runs), "runs": runs, "peak_bytes": None,
+                                      "modules": modules}
+    results["startup.import"] = {"seconds": statistics.median(imports), "runs": imports, "peak_bytes": None}
+    return results
+
+
+# Run every benchmark for one library size, inside a scratch folder laid out like the app's
+def bench_size(size, repeat, render=True, startup=True, seed=0):
+    work_folder = tempfile.mkdtemp(prefix=f"library-bench-{size}-")
+    previous_folder = os.getcwd()
+    os.chdir(work_folder)
+    try:
+        cover_store = CoverStore(os.path.join(work_folder, "book_images"))
+        covers = make_covers(cover_store, seed=seed)
+        books = make_books(size, covers, seed=seed)
+
+        results = {}
+        results.update(bench_storage(work_folder, books, repeat))
+        results.update(bench_indexes(books, repeat))
+        results.update(bench_covers(work_folder, covers, repeat))
+        # The app reads data/ from its working folder
+        os.rename(os.path.join(work_folder, "data-sqlite"), os.path.join(work_folder, "data"))
+        if render:
+            results.update(bench_render(work_folder, repeat))
+        if startup:
+            results.update(bench_startup(work_folder, repeat))
+        return results
+    finally:
+        os.chdir(previous_folder)
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=REPO_FOLDER, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, repeat, render=True, startup=True):
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "repeat": repeat,
+        "sizes": {},
+    }
+    for size in sizes:
+        report["sizes"][str(size)] = bench_size(size, repeat, render, startup)
+        report["sizes"][str(size)]["process.max_rss"] = {"seconds": None, "runs": [], "peak_bytes": max_rss_bytes()}
+        print_results(size, report["sizes"][str(size)])
+    return report
+
+
+def format_bytes(count):
+    if count is None:
+        return "-"
+    for unit in ["B", "KB", "MB", "GB"]:
+        if count < 1024 or unit == "GB":
+            return f"{count:.0f} {unit}" if unit == "B" else f"{count:.1f} {unit}"
+        count /= 1024
+
+
+def print_results(size, results):
+    print(f"\n{size} books")
+    for name, result in results.items():
+        seconds = "-" if result["seconds"] is None else f"{result['seconds'] * 1000:10.3f} ms"
+        modules = f"   loads {', '.join(result['modules']) or 'none'}" if "modules" in result else ""
+        print(f"  {name:24} {seconds:>14}   peak {format_bytes(result['peak_bytes'])}{modules}")
+
+
+# Print every timing that got slower than the baseline report by more than REGRESSION_RATIO.
+# Returns the number of regressions.
+def compare(report, baseline):
+    regressions = 0
+    print(f"\nCompared with {baseline.get('commit')} ({baseline.get('timestamp')}):")
+    for size, results in report["sizes"].items():
+        for name, result in results.items():
+            before = baseline.get("sizes", {}).get(size, {}).get(name)
+            if not before or not before["seconds"] or result["seconds"] is None:
+                continue
+            ratio = result["seconds"] / before["seconds"]
+            if ratio > REGRESSION_RATIO:
+                regressions += 1
+                print(f"  {size:>8} {name:24} {ratio:5.2f}x slower")
+    if not regressions:
+        print("  no regressions")
+    return regressions
+
+
+# Print every cold first render slower than max_seconds, returns how many there were
+def check_startup(report, max_seconds):
+    slow = 0
+    for size, results in report["sizes"].items():
+        for name, result in results.items():
+            if name.startswith("startup.") and name != "startup.import" and result["seconds"] > max_seconds:
+                slow += 1
+                print(f"  {size:>8} {name:24} {result['seconds']:.2f} s, over the {max_seconds:.2f} s cap")
+    return slow
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the library at synthetic scale.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="library sizes, e.g. 1000 1000000")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--no-render", action="store_true", help="skip the Streamlit page rerun")
+    parser.add_argument("--no-startup", action="store_true", help="skip the cold start benchmark")
+    parser.add_argument("--max-startup", type=float,
+                        help="fail when a cold first render takes longer than this many seconds")
+    parser.add_argument("--output", default="bench_results.json", help="JSON report to write")
+    parser.add_argument("--compare", help="earlier JSON report to check for regressions")
+    args = parser.parse_args(argv)
+
+    report = run(args.sizes, args.repeat, render=not args.no_render, startup=not args.no_startup)
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    print(f"\nWrote {args.output}")
+
+    failed = False
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            failed = compare(report, json.load(file)) > 0
+    if args.max_startup is not None:
+        failed = check_startup(report, args.max_startup) > 0 or failed
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import sys
+
+
+# Keys of a book record, id first. version counts the edits of the book, starting at 1.
+BOOK_KEYS = ("id", "title", "author", "year", "genre", "read", "image", "version")
+BOOK_DEFAULTS = {"id": None, "genre": "", "read": False, "image": "", "version": 1}
+
+# Years are shared like the interned strings, CPython only caches ints up to 256
+_years = {}
+
+
+# Book record with fixed slots, about a quarter of the size of the equivalent dict.
+# Authors, genres and cover paths repeat across books, so they are interned and each
+# distinct value is stored once. Reads and writes go through book["field"] like a
+# dict, and dict(book) gives a plain copy for JSON or the UI.
+class Book:
+    __slots__ = BOOK_KEYS
+
+    def __init__(self, fields):
+        for key in BOOK_KEYS:
+            self[key] = fields[key] if key in fields else BOOK_DEFAULTS[key]
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        if key not in BOOK_KEYS:
+            raise KeyError(key)
+        if key in ("author", "genre", "image") and type(value) is str:
+            value = sys.intern(value)
+        elif key == "year" and type(value) is int:
+            value = _years.setdefault(value, value)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in BOOK_KEYS
+
+    def __iter__(self):
+        return iter(BOOK_KEYS)
+
+    def __len__(self):
+        return len(BOOK_KEYS)
+
+    def __repr__(self):
+        return f"Book({dict(self)!r})"
+
+    def keys(self):
+        return BOOK_KEYS
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in BOOK_KEYS]
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in BOOK_KEYS else default
+
+    def update(self, changes):
+        for key, value in changes.items():
+            self[key] = value
+
+
+# Raised when a book was changed or removed since the caller read it.
+# book is a copy of the current book, or None when it is gone.
+class ConflictError(Exception):
+    def __init__(self, book_id, book=None):
+        self.book_id = book_id
+        self.book = book
+        what = "removed" if book is None else "changed"
+        super().__init__(f"Book #{book_id} was {what} by someone else")
+
+
+# In-memory library: the books in insertion order, indexed by their stable id.
+# Lookups, edits and removals by id are constant-time, and duplicate titles
+# are never confused because every book has its own id. Books are kept as compact
+# Book records; the dicts passed to add() get their id but are not stored themselves.
+# last_id is the highest id the storage ever saw, removed books included, so an id is
+# never given out twice and an old (id, version) can't match a new book.
+class Catalog:
+    def __init__(self, books=(), last_id=0):
+        self._by_id = {}
+        self._next_id = last_id + 1
+        self.version = 0
+        for book in books:
+            self._index(book)
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __iter__(self):
+        return iter(self._by_id.values())
+
+    def __contains__(self, book_id):
+        return book_id in self._by_id
+
+    # All books as a list, in insertion order
+    @property
+    def books(self):
+        return list(self._by_id.values())
+
+    # All ids, in insertion order
+    @property
+    def ids(self):
+        return list(self._by_id)
+
+    def get(self, book_id):
+        return self._by_id.get(book_id)
+
+    # Add a book, giving it the next free id if it doesn't have one.
+    # Returns the stored record.
+    def add(self, book):
+        record = self._index(book)
+        self.version += 1
+        return record
+
+    # The book with this id, for a change based on expected_version of it.
+    # Raises ConflictError if the book is gone or, given expected_version, has moved past it.
+    def check(self, book_id, expected_version=None):
+        book = self._by_id.get(book_id)
+        if book is None:
+            raise ConflictError(book_id)
+        if expected_version is not None and book["version"] != expected_version:
+            raise ConflictError(book_id, dict(book))
+        return book
+
+    # Apply changes to the book with this id, bump its version and return it
+    def update(self, book_id, changes, expected_version=None):
+        book = self.check(book_id, expected_version)
+        version = book["version"]
+        book.update(changes)
+        book["id"] = book_id
+        book["version"] = version + 1
+        self.version += 1
+        return book
+
+    # Remove the book with this id and return it
+    def remove(self, book_id, expected_version=None):
+        book = self.check(book_id, expected_version)
+        del self._by_id[book_id]
+        self.version += 1
+        return book
+
+    def _index(self, book):
+        if book.get("id") is None:
+            book["id"] = self._next_id
+        record = self._by_id[book["id"]] = Book(book)
+        self._next_id = max(self._next_id, book["id"] + 1)
+        return record
+
+
+# Give every book without an id a unique one, returns True if any id was added
+def assign_missing_ids(books):
+    next_id = max((book["id"] for book in books if book.get("id") is not None), default=0) + 1
+    changed = False
+    for book in books:
+        if book.get("id") is None:
+            book["id"] = next_id
+            next_id += 1
+            changed = True
+    return changed
@@ -0,0 +1,169 @@
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+# Thumbnails generated for every cover, as bounding boxes (aspect ratio is kept)
+THUMBNAIL_SIZES = {
+    "small": (150, 150),
+    "card": (400, 400),
+}
+
+# Size shown on the book cards
+CARD_SIZE = "card"
+
+# Thumbnails are written to the app's static folder and served by Streamlit
+# (server.enableStaticServing) at app/static/..., so cards link to them by URL.
+STATIC_FOLDER = "static"
+STATIC_URL_PREFIX = "app/static/"
+THUMBNAIL_FOLDER = os.path.join(STATIC_FOLDER, "covers")
+# Where thumbnails used to be kept, next to the covers
+OLD_THUMBNAIL_FOLDER_NAME = "thumbs"
+DEFAULT_FORMAT = "webp"
+DEFAULT_QUALITY = 80
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".gif", ".bmp"}
+
+FORMAT_EXTENSIONS = {
+    "webp": ".webp",
+    "jpeg": ".jpg",
+}
+
+
+# Where the thumbnail of a given size for a cover lives. Covers are named by the
+# hash of their content, so the thumbnail name (and its URL) is unique to the image.
+def thumbnail_path(image_path, size, fmt=DEFAULT_FORMAT):
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    return os.path.join(THUMBNAIL_FOLDER, f"{stem}-{size}{FORMAT_EXTENSIONS[fmt]}")
+
+
+# URL of a cover's thumbnail, or None until it has been generated
+def thumbnail_url(image_path, size=CARD_SIZE, fmt=DEFAULT_FORMAT):
+    if not image_path:
+        return None
+    path = thumbnail_path(image_path, size, fmt)
+    if not os.path.exists(path):
+        return None
+    return STATIC_URL_PREFIX + os.path.relpath(path, STATIC_FOLDER).replace(os.sep, "/")
+
+
+# True if Pillow can read the file as an image
+def is_image(path):
+    from PIL import Image
+
+    try:
+        with Image.open(path) as image:
+            image.verify()
+    except Exception:
+        return False
+    return True
+
+
+# Open an image for downscaling to fit within max_size, as cheaply as possible:
+# JPEGs are decoded at reduced scale with draft(), other formats shrink with reduce()
+def _open_for_size(image_path, max_size):
+    from PIL import Image, ImageOps
+
+    image = Image.open(image_path)
+    if image.format == "JPEG":
+        image.draft("RGB", max_size)
+    image = ImageOps.exif_transpose(image)
+    # reduce() only takes some modes, palette, 1-bit and 16-bit images are converted first
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA")
+
+    factor = min(image.width // (max_size[0] * 2), image.height // (max_size[1] * 2))
+    if factor >= 2:
+        image = image.reduce(factor)
+    return image
+
+
+# Generate every thumbnail size for one cover and return {size: path}.
+# Runs in the worker processes, so it only takes plain arguments.
+# Pillow is imported here rather than at the top, so the app and the service only load it
+# when a cover is actually processed.
+def process_cover(image_path, fmt=DEFAULT_FORMAT, quality=DEFAULT_QUALITY, sizes=None):
+    from PIL import Image
+
+    sizes = sizes or THUMBNAIL_SIZES
+    largest = max(sizes.values())
+    source = _open_for_size(image_path, largest)
+    if fmt == "jpeg":
+        source = source.convert("RGB")
+
+    outputs = {}
+    # Largest first, so every smaller size is made from an already reduced image
+    for size, box in sorted(sizes.items(), key=lambda item: item[1], reverse=True):
+        source.thumbnail(box, Image.Resampling.LANCZOS)
+        output_path = thumbnail_path(image_path, size, fmt)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        tmp_path = f"{output_path}.{os.getpid()}.tmp"
+        source.save(tmp_path, format=fmt.upper(), quality=quality)
+        os.replace(tmp_path, output_path)
+        outputs[size] = output_path
+    return outputs
+
+
+# Background pool that turns covers into thumbnails off the Streamlit script thread
+class CoverProcessor:
+    def __init__(self, max_workers=None, fmt=DEFAULT_FORMAT, quality=DEFAULT_QUALITY):
+        self.fmt = fmt
+        self.quality = quality
+        # spawn keeps the workers clean of the parent's threads and locks
+        self._pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    # Queue a cover, returns a Future of {size: path}
+    def submit(self, image_path):
+        return self._pool.submit(process_cover, image_path, self.fmt, self.quality)
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+
+# All original covers in a folder and its subfolders (thumbnails excluded)
+def find_covers(image_folder):
+    covers = []
+    for folder, subfolders, file_names in os.walk(image_folder):
+        subfolders[:] = [name for name in subfolders if name != OLD_THUMBNAIL_FOLDER_NAME]
+        covers.extend(
+            os.path.join(folder, file_name)
+            for file_name in file_names
+            if os.path.splitext(file_name)[1].lower() in IMAGE_EXTENSIONS
+        )
+    return sorted(covers)
+
+
+# Regenerate the thumbnails of every cover in a folder, returns (done, failed)
+def reprocess_folder(image_folder, fmt=DEFAULT_FORMAT, quality=DEFAULT_QUALITY, max_workers=None):
+    processor = CoverProcessor(max_workers=max_workers, fmt=fmt, quality=quality)
+    done, failed = 0, []
+    try:
+        futures = {processor.submit(path): path for path in find_covers(image_folder)}
+        for future in as_completed(futures):
+            try:
+                future.result()
+                done += 1
+            # One unreadable or unusual file mustn't stop the others
+            except Exception as error:
+                failed.append((futures[future], error))
+    finally:
+        processor.shutdown()
+    return done, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Regenerate cover thumbnails.")
+    parser.add_argument("folder", nargs="?", default="book_images")
+    parser.add_argument("--format", choices=sorted(FORMAT_EXTENSIONS), default=DEFAULT_FORMAT)
+    parser.add_argument("--quality", type=int, default=DEFAULT_QUALITY)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    done, failed = reprocess_folder(args.folder, args.format, args.quality, args.workers)
+    print(f"Processed {done} covers, {len(failed)} failed.")
+    for path, error in failed:
+        print(f"  {path}: {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import argparse
+import hashlib
+import os
+import shutil
+import threading
+from collections import Counter
+
+from cover_images import FORMAT_EXTENSIONS, THUMBNAIL_SIZES, thumbnail_path
+
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+# Covers stored by the SHA-256 of their bytes: <folder>/<first 2 hex>/<hash><ext>.
+# Identical images share one file, and a cover's path never changes meaning,
+# so anything derived from it (thumbnails and their URLs) stays valid forever.
+class CoverStore:
+    def __init__(self, folder):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def path_for(self, digest, extension):
+        return os.path.join(self.folder, digest[:2], f"{digest}{extension.lower()}")
+
+    # True if the path is a content-addressed cover of this store
+    def owns(self, image_path):
+        if not image_path:
+            return False
+        folder, file_name = os.path.split(os.path.normpath(image_path))
+        digest = os.path.splitext(file_name)[0]
+        return (
+            os.path.dirname(folder) == os.path.normpath(self.folder)
+            and len(digest) == 64
+            and os.path.basename(folder) == digest[:2]
+        )
+
+    # Store image bytes, returns (path, created) where created is False for a duplicate
+    def put_bytes(self, data, extension):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path_for(digest, extension)
+        if os.path.exists(path):
+            return path, False
+        self._write(path, lambda file: file.write(data))
+        return path, True
+
+    # Store a copy of an image file, returns (path, created)
+    def put_file(self, source_path):
+        if self.owns(source_path):
+            return source_path, False
+        sha = hashlib.sha256()
+        with open(source_path, "rb") as file:
+            for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+                sha.update(chunk)
+        path = self.path_for(sha.hexdigest(), os.path.splitext(source_path)[1] or ".png")
+        if os.path.exists(path):
+            return path, False
+
+        def copy(file):
+            with open(source_path, "rb") as source:
+                shutil.copyfileobj(source, file)
+        self._write(path, copy)
+        return path, True
+
+    # Delete a cover and its thumbnails
+    def delete(self, image_path):
+        paths = [image_path] + [
+            thumbnail_path(image_path, size, fmt) for size in THUMBNAIL_SIZES for fmt in FORMAT_EXTENSIONS
+        ]
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        # Drop the fan-out folder once it is empty
+        if self.owns(image_path):
+            try:
+                os.rmdir(os.path.dirname(image_path))
+            except OSError:
+                pass
+
+    def _write(self, path, write):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as file:
+            write(file)
+        os.replace(tmp_path, path)
+
+
+# Number of books using each cover, kept up to date one book at a time
+# so a removed or replaced cover can be deleted as soon as nothing uses it
+class CoverRefs:
+    def __init__(self):
+        self.generation = None
+        self._lock = threading.Lock()
+        self._images = {}
+        self._counts = Counter()
+
+    def count(self, image_path):
+        return self._counts.get(image_path, 0)
+
+    def rebuild(self, books, generation=None):
+        with self._lock:
+            self._images = {book["id"]: book.get("image", "") for book in books}
+            self._counts = Counter(image for image in self._images.values() if image)
+            self.generation = generation
+
+    def add(self, book):
+        with self._lock:
+            self._remove(book["id"])
+            self._images[book["id"]] = book.get("image", "")
+            if self._images[book["id"]]:
+                self._counts[self._images[book["id"]]] += 1
+
+    def update(self, book):
+        self.add(book)
+
+    def remove(self, book_id):
+        with self._lock:
+            self._remove(book_id)
+
+    def _remove(self, book_id):
+        image = self._images.pop(book_id, None)
+        if image:
+            self._counts[image] -= 1
+            if self._counts[image] <= 0:
+                del self._counts[image]
+
+
+# Find a referenced cover file, also accepting Windows-style separators
+def find_image(image_path):
+    if not image_path:
+        return None
+    for candidate in (image_path, image_path.replace("\\", os.sep)):
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+# One-shot move of an existing cover folder to content-addressed storage.
+# Every referenced cover is copied into the store, the library is saved once with
+# the new paths, then the legacy files that were moved (and their thumbnails) are
+# deleted. Given a CoverProcessor, thumbnails are made for the new files.
+# Returns (moved, missing, unreferenced) counts.
+def migrate_covers(storage, cover_store, cover_processor=None):
+    books = storage.load()
+    moved_sources = set()
+    missing = 0
+    for book in books:
+        source = find_image(book.get("image", ""))
+        if source is None:
+            missing += bool(book.get("image"))
+            continue
+        if cover_store.owns(source):
+            continue
+        book["image"], created = cover_store.put_file(source)
+        moved_sources.add(source)
+        if created and cover_processor is not None:
+            cover_processor.submit(book["image"])
+    storage.save(books)
+
+    for source in moved_sources:
+        cover_store.delete(source)
+
+    unreferenced = sum(
+        1 for file_name in os.listdir(cover_store.folder)
+        if os.path.isfile(os.path.join(cover_store.folder, file_name))
+    )
+    return len(moved_sources), missing, unreferenced
+
+
+def main(argv=None):
+    from cover_images import CoverProcessor
+    from library_service import DATA_FOLDER, DEFAULT_BACKEND, IMAGE_FOLDER
+    from storage import BACKENDS, open_storage
+
+    parser = argparse.ArgumentParser(description="Move existing covers to content-addressed storage.")
+    parser.add_argument("--backend", default=os.environ.get("LIBRARY_BACKEND", DEFAULT_BACKEND), choices=BACKENDS)
+    parser.add_argument("--data-folder", default=DATA_FOLDER)
+    parser.add_argument("--image-folder", default=IMAGE_FOLDER)
+    args = parser.parse_args(argv)
+
+    cover_processor = CoverProcessor()
+    try:
+        moved, missing, unreferenced = migrate_covers(open_storage(args.backend, args.data_folder),
+                                                      CoverStore(args.image_folder), cover_processor)
+    finally:
+        # Wait for the thumbnails before exiting
+        cover_processor.shutdown()
+    print(f"Moved {moved} covers, {missing} books point at missing files, "
+          f"{unreferenced} unreferenced files left in {args.image_folder}.")
+
+
+if __name__ == "__main__":
+    main()
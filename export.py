@@ -0,0 +1,95 @@
+import csv
+import glob
+import hashlib
+import io
+import json
+import os
+import textwrap
+import threading
+
+
+# Fields written to CSV and JSON exports
+EXPORT_FIELDS = ["id", "title", "author", "year", "genre", "read", "image"]
+
+# Books serialised per chunk before it is written out
+CHUNK_SIZE = 1000
+
+
+# Yield the library as CSV text, a chunk of rows at a time
+def iter_csv(books, chunk_size=CHUNK_SIZE):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(EXPORT_FIELDS)
+    for count, book in enumerate(books, 1):
+        writer.writerow([book.get(field, "") for field in EXPORT_FIELDS])
+        if count % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+# Yield the library as a JSON array (same layout as json.dumps(..., indent=4)), a chunk of books at a time
+def iter_json(books, chunk_size=CHUNK_SIZE):
+    chunk = []
+    first = True
+    for book in books:
+        chunk.append(textwrap.indent(json.dumps({field: book[field] for field in EXPORT_FIELDS}, indent=4), "    "))
+        if len(chunk) == chunk_size:
+            yield ("[\n" if first else ",\n") + ",\n".join(chunk)
+            chunk = []
+            first = False
+    if chunk:
+        yield ("[\n" if first else ",\n") + ",\n".join(chunk)
+        first = False
+    yield "[]" if first else "\n]"
+
+
+EXPORT_FORMATS = {
+    "csv": iter_csv,
+    "json": iter_json,
+}
+
+
+# Short, filename-safe tag for a library generation or a set of filters
+def export_version(value):
+    return hashlib.sha1(repr(value).encode("utf-8")).hexdigest()[:12]
+
+
+# Where the export of a generation, narrowed by filters (a tag, "all" for none), goes
+def export_path(fmt, folder, generation, filters="all"):
+    return os.path.join(folder, f"library-{generation}-{filters}.{fmt}")
+
+
+# Write the books to folder/library-<generation>-<filters>.<fmt> and return the path.
+# A file that already exists for them is reused. Exports of other generations are
+# deleted, they hold an older library: a write moves the generation on for everyone.
+# Exports of the same generation with other filters are left for whoever asked for them.
+# progress(fraction), if given, is called after every chunk; raising from it stops the
+# export and leaves no file behind.
+def export_library(books, fmt, folder, generation, filters="all", progress=None):
+    path = export_path(fmt, folder, generation, filters)
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(folder, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8", newline="") as file:
+            for count, chunk in enumerate(EXPORT_FORMATS[fmt](books), 1):
+                file.write(chunk)
+                if progress is not None:
+                    progress(min(1.0, count * CHUNK_SIZE / max(1, len(books))))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    current = os.path.join(folder, f"library-{generation}-")
+    for old_path in glob.glob(os.path.join(folder, f"library-*-*.{fmt}")):
+        if not old_path.startswith(current):
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+    return path
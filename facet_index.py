@@ -0,0 +1,160 @@
+import threading
+
+
+# Positions of the set bits in each byte value, for decoding bitmaps a byte at a time
+_BYTE_BITS = [tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)]
+
+
+# Ids whose bit is set in a bitmap, in ascending order
+def bitmap_ids(bitmap):
+    ids = []
+    for index, byte in enumerate(bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")):
+        if byte:
+            base = index * 8
+            ids.extend(base + bit for bit in _BYTE_BITS[byte])
+    return ids
+
+
+# Filters that select every book
+NO_FILTERS = {"genres": (), "years": None, "read": None}
+
+
+def filters_active(filters):
+    return bool(filters) and filters != NO_FILTERS
+
+
+# Genre, year and read-status facets of the library as bitmaps.
+# Every facet value has a Python int whose bit n is set when book id n has that value,
+# so a combined filter is a few ANDs/ORs and a count is int.bit_count().
+# Changes flip single bits instead of rebuilding.
+class FacetIndex:
+    def __init__(self):
+        self.generation = None
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._facets = {}
+        self._all = 0
+        self._read = 0
+        self._genres = {}
+        self._years = {}
+
+    def __len__(self):
+        return len(self._facets)
+
+    # Replace the bitmaps with the given books
+    def rebuild(self, books, generation=None):
+        with self._lock:
+            self._reset()
+            # Collect bit positions first, one big OR per value is much cheaper than one per book
+            genre_ids, year_ids, read_ids = {}, {}, []
+            for book in books:
+                facets = _facets(book)
+                self._facets[book["id"]] = facets
+                genre_ids.setdefault(facets[0], []).append(book["id"])
+                year_ids.setdefault(facets[1], []).append(book["id"])
+                if facets[2]:
+                    read_ids.append(book["id"])
+            self._all = _bitmap(self._facets)
+            self._read = _bitmap(read_ids)
+            self._genres = {genre: _bitmap(ids) for genre, ids in genre_ids.items()}
+            self._years = {year: _bitmap(ids) for year, ids in year_ids.items()}
+            self.generation = generation
+
+    def add(self, book):
+        with self._lock:
+            self._add(book)
+
+    def update(self, book):
+        with self._lock:
+            self._remove(book["id"])
+            self._add(book)
+
+    def remove(self, book_id):
+        with self._lock:
+            self._remove(book_id)
+
+    # Every genre in the library, sorted
+    def genres(self):
+        with self._lock:
+            return sorted(self._genres)
+
+    # (lowest year, highest year), or None for an empty library
+    def year_bounds(self):
+        with self._lock:
+            return (min(self._years), max(self._years)) if self._years else None
+
+    # Bitmap of the books matching the filters: any of the genres, a year within
+    # the (low, high) range and the read status; empty or None means no restriction
+    def mask(self, genres=(), years=None, read=None):
+        with self._lock:
+            return self._mask(genres, years, read)
+
+    # Number of matching books per genre and per read status. Each facet is counted
+    # with the other facets applied but not itself, so its options show what picking them gives.
+    def counts(self, genres=(), years=None, read=None):
+        with self._lock:
+            without_genre = self._mask((), years, read)
+            without_read = self._mask(genres, years, None)
+            read_books = (without_read & self._read).bit_count()
+            return {
+                "total": self._mask(genres, years, read).bit_count(),
+                "genres": {genre: (bitmap & without_genre).bit_count() for genre, bitmap in self._genres.items()},
+                "read": {True: read_books, False: without_read.bit_count() - read_books},
+            }
+
+    def _mask(self, genres, years, read):
+        mask = self._all
+        if genres:
+            selected = 0
+            for genre in genres:
+                selected |= self._genres.get(genre, 0)
+            mask &= selected
+        if years is not None:
+            low, high = years
+            selected = 0
+            for year, bitmap in self._years.items():
+                if low <= year <= high:
+                    selected |= bitmap
+            mask &= selected
+        if read is not None:
+            mask = mask & self._read if read else mask & ~self._read
+        return mask
+
+    def _add(self, book):
+        if book["id"] in self._facets:
+            self._remove(book["id"])
+        genre, year, read = self._facets[book["id"]] = _facets(book)
+        bit = 1 << book["id"]
+        self._all |= bit
+        self._genres[genre] = self._genres.get(genre, 0) | bit
+        self._years[year] = self._years.get(year, 0) | bit
+        if read:
+            self._read |= bit
+
+    def _remove(self, book_id):
+        facets = self._facets.pop(book_id, None)
+        if facets is None:
+            return
+        genre, year, read = facets
+        bit = 1 << book_id
+        self._all &= ~bit
+        self._read &= ~bit
+        for bitmaps, value in ((self._genres, genre), (self._years, year)):
+            bitmaps[value] &= ~bit
+            if not bitmaps[value]:
+                del bitmaps[value]
+
+
+# Facet values of a single book
+def _facets(book):
+    return (book.get("genre", ""), int(book["year"]), bool(book["read"]))
+
+
+# Bitmap with the bits of the given ids set
+def _bitmap(ids):
+    bitmap = bytearray((max(ids, default=-1) >> 3) + 1)
+    for book_id in ids:
+        bitmap[book_id >> 3] |= 1 << (book_id & 7)
+    return int.from_bytes(bitmap, "little")
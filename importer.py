@@ -0,0 +1,250 @@
+import argparse
+import csv
+import io
+import json
+import os
+from functools import partial
+
+from cover_images import is_image
+from cover_store import find_image
+
+
+# Column names accepted for each book field, lower-cased.
+# Covers our own CSV/JSON exports and Goodreads library exports.
+FIELD_ALIASES = {
+    "title": ["title"],
+    "author": ["author", "authors", "author l-f"],
+    "year": ["year", "year published", "original publication year", "publication year"],
+    "genre": ["genre", "genres"],
+    "read": ["read", "exclusive shelf", "status"],
+    "image": ["image", "cover"],
+}
+
+READ_VALUES = {"true", "yes", "1", "read"}
+JSON_CHUNK_SIZE = 64 * 1024
+# Rows between two progress() calls
+PROGRESS_ROWS = 500
+
+
+# Yield the objects of a top-level JSON array without loading the whole file
+def iter_json_records(text_file, chunk_size=JSON_CHUNK_SIZE):
+    decoder = json.JSONDecoder()
+    buffer = text_file.read(chunk_size)
+    position = len(buffer) - len(buffer.lstrip())
+    if buffer[position:position + 1] != "[":
+        raise ValueError("JSON import must be a list of books")
+    position += 1
+    eof = False
+
+    while True:
+        # Skip separators, reading more text when the buffer runs out
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position < len(buffer) or eof:
+                break
+            buffer, position = text_file.read(chunk_size), 0
+            eof = not buffer
+
+        if position >= len(buffer):
+            raise ValueError("JSON import ended before the closing ]")
+        if buffer[position] == "]":
+            return
+
+        try:
+            record, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            more = text_file.read(chunk_size)
+            if not more:
+                raise
+            buffer, position = buffer[position:] + more, 0
+            continue
+        yield record
+        position = end
+        if position > chunk_size:
+            buffer, position = buffer[position:], 0
+
+
+# Yield raw rows from a CSV or JSON text stream
+def iter_rows(text_file, fmt):
+    if fmt == "json":
+        yield from iter_json_records(text_file)
+    else:
+        yield from csv.DictReader(text_file)
+
+
+# Turn a raw row into a book dict, raises ValueError if it can't be used
+def normalize_row(row):
+    fields = {str(key).strip().lower(): value for key, value in row.items() if key is not None}
+
+    def pick(field):
+        for alias in FIELD_ALIASES[field]:
+            value = fields.get(alias)
+            if value not in (None, ""):
+                return value
+        return ""
+
+    title = str(pick("title")).strip()
+    author = str(pick("author")).strip()
+    year = str(pick("year")).strip()
+    if not title or not author:
+        raise ValueError("missing title or author")
+    if not year.lstrip("-").isdigit():
+        raise ValueError(f"invalid year {year!r} for '{title}'")
+
+    read = pick("read")
+    if not isinstance(read, bool):
+        read = str(read).strip().lower() in READ_VALUES
+
+    return {
+        "title": title,
+        "author": author,
+        "year": int(year),
+        "genre": str(pick("genre")).strip(),
+        "read": read,
+        "image": str(pick("image")).strip(),
+    }
+
+
+# Key used to spot the same book twice
+def dedupe_key(book):
+    return (book["title"].casefold(), book["author"].casefold(), int(book["year"]))
+
+
+# Import books from a CSV or JSON text stream into the shared library.
+# Rows are streamed, validated and deduplicated against the library and each other,
+# and everything is written with one add_many(). Covers are then copied into the CoverStore,
+# where repeated images share one file, and given a CoverProcessor the thumbnails of
+# new covers are made on its process pool. Only files Pillow can read are taken as covers,
+# and given image_folder only files inside it. progress(rows), if given, is called every
+# PROGRESS_ROWS rows; raising from it stops the import before any book is written.
+def import_books(text_file, fmt, shared_library, cover_store, cover_processor=None, max_errors=20, progress=None,
+                 image_folder=None):
+    with shared_library.read() as library:
+        seen = {dedupe_key(book) for book in library}
+
+    result = {"imported": 0, "duplicates": 0, "invalid": 0, "errors": []}
+    books = []
+    # (book, cover file) of the books that have a cover
+    sources = []
+
+    for line, row in enumerate(iter_rows(text_file, fmt), 1):
+        if progress is not None and line % PROGRESS_ROWS == 0:
+            progress(line)
+        try:
+            if not isinstance(row, dict):
+                raise ValueError("not a book record")
+            book = normalize_row(row)
+        except ValueError as error:
+            result["invalid"] += 1
+            if len(result["errors"]) < max_errors:
+                result["errors"].append(f"Row {line}: {error}")
+            continue
+
+        key = dedupe_key(book)
+        if key in seen:
+            result["duplicates"] += 1
+            continue
+        seen.add(key)
+
+        source = find_image(book["image"])
+        if source is not None and not (_inside(source, image_folder) and is_image(source)):
+            if len(result["errors"]) < max_errors:
+                result["errors"].append(f"Row {line}: cover {book['image']!r} is not an image that can be "
+                                        f"imported, the book was added without it")
+            source = None
+        book["image"] = ""
+        if source is not None:
+            sources.append((book, source))
+        books.append(book)
+
+    # Covers are copied once every row is read, and the ones this import added are
+    # deleted again if the books can't be written, so nothing is left without a book
+    covers, created = [], []
+    try:
+        for book, source in sources:
+            try:
+                book["image"], is_new = cover_store.put_file(source)
+            except OSError:
+                continue
+            if is_new:
+                created.append(book["image"])
+            covers.append((book["image"], partial(store_cover, source, cover_store, cover_processor)))
+        if books:
+            shared_library.add_many(books, covers)
+    except Exception:
+        for image_path in created:
+            cover_store.delete(image_path)
+        raise
+    if cover_processor is not None:
+        for image_path in created:
+            cover_processor.submit(image_path)
+    result["imported"] = len(books)
+    return result
+
+
+# Copy a cover file into the CoverStore and return its path, thumbnails of a new cover
+# are made on the CoverProcessor
+def store_cover(source, cover_store, cover_processor=None):
+    image_path, created = cover_store.put_file(source)
+    if created and cover_processor is not None:
+        cover_processor.submit(image_path)
+    return image_path
+
+
+# True if path is inside folder, or folder is None
+def _inside(path, folder):
+    if folder is None:
+        return True
+    folder = os.path.realpath(folder)
+    return os.path.commonpath([os.path.realpath(path), folder]) == folder
+
+
+# Pick the import format from a file name
+def detect_format(file_name):
+    return "json" if file_name.lower().endswith(".json") else "csv"
+
+
+# Import an uploaded (binary) file. progress(fraction, rows), if given, follows how much
+# of the file was read. The file comes from a browser, so its covers can only name images
+# already in the cover store's folder, never other files of the server.
+def import_upload(uploaded_file, shared_library, cover_store, cover_processor=None, progress=None):
+    size = uploaded_file.seek(0, io.SEEK_END)
+    uploaded_file.seek(0)
+    rows_progress = None
+    if progress is not None:
+        def rows_progress(rows):
+            progress(uploaded_file.tell() / size if size else None, rows)
+    text_file = io.TextIOWrapper(uploaded_file, encoding="utf-8-sig", newline="")
+    return import_books(text_file, detect_format(uploaded_file.name), shared_library, cover_store, cover_processor,
+                        progress=rows_progress, image_folder=cover_store.folder)
+
+
+def main(argv=None):
+    from library_service import DATA_FOLDER, DEFAULT_BACKEND, IMAGE_FOLDER, LibraryService
+    from storage import BACKENDS
+
+    parser = argparse.ArgumentParser(description="Bulk import books from CSV, JSON or a Goodreads export.")
+    parser.add_argument("path", help="file to import")
+    parser.add_argument("--format", choices=["csv", "json"], help="defaults to the file extension")
+    parser.add_argument("--backend", default=os.environ.get("LIBRARY_BACKEND", DEFAULT_BACKEND), choices=BACKENDS)
+    parser.add_argument("--data-folder", default=DATA_FOLDER)
+    parser.add_argument("--image-folder", default=IMAGE_FOLDER)
+    args = parser.parse_args(argv)
+
+    service = LibraryService(args.data_folder, args.image_folder, args.backend)
+    try:
+        with open(args.path, "r", encoding="utf-8-sig", newline="") as text_file:
+            result = service.import_books(text_file, args.format or detect_format(args.path))
+    finally:
+        # Wait for the thumbnails before exiting
+        service.close()
+
+    print(f"Imported {result['imported']} books, skipped {result['duplicates']} duplicates "
+          f"and {result['invalid']} invalid rows.")
+    for error in result["errors"]:
+        print(f"  {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Jobs that run at the same time, the rest wait their turn
+DEFAULT_WORKERS = 2
+# Finished jobs kept for their results, the oldest are dropped first
+KEEP_FINISHED = 100
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+logger = logging.getLogger("library.jobs")
+
+
+# Raised inside a job by report() once the job was cancelled
+class JobCancelled(Exception):
+    pass
+
+
+# One piece of background work. Its function gets the job as first argument and calls
+# job.report() as it goes, which records progress and stops the job if it was cancelled.
+# The other attributes are only written by the worker and safe to read from any thread.
+class Job:
+    def __init__(self, job_id, name, key=None):
+        self.id = job_id
+        self.name = name
+        self.key = key
+        self.status = QUEUED
+        # 0.0 to 1.0, or None while the job can't tell
+        self.progress = 0.0
+        self.message = ""
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.ended = None
+        self._cancel = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    # Record progress and an optional message, raises JobCancelled if the job was cancelled
+    def report(self, progress=None, message=None):
+        if self._cancel.is_set():
+            raise JobCancelled()
+        self.progress = progress
+        if message is not None:
+            self.message = message
+
+
+# In-process queue of background jobs run by a bounded thread pool, so slow work leaves
+# the Streamlit script thread and at most max_workers jobs compete for the library at once.
+# Jobs are looked up by id; cancelling is cooperative, a running job stops at its next report().
+class JobQueue:
+    def __init__(self, max_workers=DEFAULT_WORKERS, keep_finished=KEEP_FINISHED):
+        self.max_workers = max_workers
+        self.keep_finished = keep_finished
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="library-job")
+        self._jobs = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    # Queue fn(job, *args, **kwargs) and return the job id. Given a key, a job with the
+    # same key that hasn't finished yet is reused instead of starting another one.
+    def submit(self, name, fn, *args, key=None, **kwargs):
+        with self._lock:
+            if key is not None:
+                for job in self._jobs.values():
+                    if job.key == key and not job.finished:
+                        return job.id
+            job = Job(next(self._ids), name, key)
+            self._jobs[job.id] = job
+            self._prune()
+        self._pool.submit(self._run, job, fn, args, kwargs)
+        return job.id
+
+    # The job with this id, or None once it was dropped
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    # The jobs with these ids that still exist, in the same order
+    def get_many(self, job_ids):
+        with self._lock:
+            return [self._jobs[job_id] for job_id in job_ids if job_id in self._jobs]
+
+    # Stop a job: a queued one never starts, a running one stops at its next report().
+    # Returns False if the job already finished.
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return False
+        job._cancel.set()
+        return True
+
+    def shutdown(self, wait=True, cancel=False):
+        if cancel:
+            with self._lock:
+                for job in self._jobs.values():
+                    job._cancel.set()
+        self._pool.shutdown(wait=wait)
+
+    def _run(self, job, fn, args, kwargs):
+        if job._cancel.is_set():
+            job.status, job.ended = CANCELLED, time.time()
+            return
+        job.status, job.started = RUNNING, time.time()
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.progress = 1.0
+            job.status = DONE
+        except JobCancelled:
+            job.status = CANCELLED
+        except Exception as error:
+            logger.exception("Job %s (%s) failed", job.id, job.name)
+            job.error = str(error) or type(error).__name__
+            job.status = FAILED
+        finally:
+            job.ended = time.time()
+
+    # Drop the oldest finished jobs beyond keep_finished, called with the lock held
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job_id]
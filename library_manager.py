@@ -1,42 +1,294 @@
 import streamlit as st
-import json
 import os
-from PIL import Image
-import base64
-import pandas as pd
-import plotly.express as px
+import math
+from cover_images import thumbnail_url
+from facet_index import NO_FILTERS
+from library_service import ConflictError, LibraryService
+from thumbnail_cache import ThumbnailCache
+from timings import Timings
+
+
+PLACEHOLDER_IMAGE = "placeholder.png"
+BOOKS_PER_PAGE_OPTIONS = [12, 24, 48, 96]
+# Libraries this big are exported, and their statistics built, by background jobs
+BACKGROUND_BOOKS = 20000
+# How often the jobs panel refreshes while a job is running, in seconds
+JOB_POLL_SECONDS = 1
+# Page timings are off unless LIBRARY_TIMINGS=1 or switched on from the diagnostics page (?diagnostics=1)
+TIMINGS_ENABLED = os.environ.get("LIBRARY_TIMINGS") == "1"
+# Served by Streamlit at app/static/diagnostics.json
+TIMINGS_FILE = os.path.join("static", "diagnostics.json")
+
+# Phase timings shared by every session
+@st.cache_resource
+def get_timings():
+    return Timings(enabled=TIMINGS_ENABLED, snapshot_path=TIMINGS_FILE)
+
+timings = get_timings()
+
+# The library behind every page, shared by every session.
+# Storage comes from LIBRARY_BACKEND (sqlite by default, json or journal).
+# The indexes are built by a job from the start, so the first pages don't wait for them.
+@st.cache_resource
+def get_service():
+    service = LibraryService()
+    service.start_indexing()
+    return service
+
+service = get_service()
+
+# Function to follow a job started by this session in the jobs panel
+def track_job(job_id):
+    job_ids = st.session_state.setdefault("job_ids", [])
+    if job_id not in job_ids:
+        job_ids.append(job_id)
+
+# Function to show this session's jobs with their progress in the sidebar. It reruns on its own
+# every JOB_POLL_SECONDS while a job is unfinished, and reruns the whole page when one finishes
+# so the page shows the result.
+def render_jobs_panel():
+    jobs = service.jobs.get_many(st.session_state.get("job_ids", []))
+    active = [job.id for job in jobs if not job.finished]
+    if set(st.session_state.get("jobs_active", [])) - set(active):
+        st.session_state["jobs_active"] = active
+        st.rerun()
+    st.session_state["jobs_active"] = active
+    if not jobs:
+        return
+
+    st.markdown("### Background Jobs")
+    for job in jobs:
+        if not job.finished:
+            label = f"{job.name}: {job.message or job.status}"
+            st.progress(job.progress or 0.0, text=label)
+            if job.cancel_requested:
+                st.caption("Cancelling...")
+            elif st.button("Cancel", key=f"cancel_job_{job.id}"):
+                service.jobs.cancel(job.id)
+                st.rerun(scope="fragment")
+        elif job.status == "done":
+            st.markdown(f"<div class='stSuccess'>✔ {job.name}: {job.message or 'done'} </div>", unsafe_allow_html=True)
+            for error in job.result.get("errors", []) if isinstance(job.result, dict) else []:
+                st.caption(error)
+        elif job.status == "failed":
+            st.markdown(f'<div class="stError">⚠️ {job.name} failed: {job.error} </div>', unsafe_allow_html=True)
+        else:
+            st.caption(f"{job.name} was cancelled.")
+
+    if not active and st.button("Clear Finished Jobs", key="clear_jobs"):
+        st.session_state["job_ids"] = []
+        st.rerun()
+
+# Data URI cache for covers that have no thumbnail yet, shared by every session and rerun
+@st.cache_resource
+def get_thumbnail_cache():
+    return ThumbnailCache()
+
+# Function to get the image source of a book cover: the static URL of its thumbnail,
+# which the browser caches, or until that exists an inline data URI (placeholder as last resort)
+def cover_src(book):
+    url = thumbnail_url(book["image"])
+    if url:
+        return url
+    cache = get_thumbnail_cache()
+    return (book["image"] and cache.get_data_uri(book["image"])) or cache.get_data_uri(PLACEHOLDER_IMAGE)
+
+# Function to turn an uploaded cover into the (bytes, extension) the service stores as-is;
+# its thumbnails are made in the background
+def cover_upload(uploaded_image):
+    return uploaded_image.getvalue(), os.path.splitext(uploaded_image.name)[1]
+
+# Function to render a single book card
+def render_book_card(book, unread_label="Unread"):
+    img_src = cover_src(book)
+    st.markdown(
+        f"""
+        <div style="
+        border-radius: 10px;
+        padding: 20px;
+        margin-bottom: 15px;
+        box-shadow: 4px 4px 12px rgba(215, 176, 139, 0.96);
+        background-color: rgb(255, 234, 223);
+        ">
+        <img src="{img_src}" width="300px" height="200px" style="border-radius: 5px; object-fit: contain;" />
+        <h5 style="color: #000000; margin-top:10px">{book['title']}</h5>
+        <p><strong>Author:</strong> {book['author']}</p>
+        <p><strong>Genre:</strong> {book['genre']}</p>
+        <p><strong>Year:</strong> {book['year']}</p>
+        <p><strong>Status:</strong> {'Read' if book['read'] else unread_label}</p>
+        </div>
+        """,
+        unsafe_allow_html=True
+    )
+
+# Read status options of the filter, with the value FacetIndex takes for each
+READ_FILTERS = {"All": None, "Read": True, "Unread": False}
+
+# Function to render the genre, year and read filters of a grid and return the chosen filters.
+# Counts come from the facet bitmaps and show how many books each option would leave.
+def render_book_filters(key, unread_label="Unread"):
+    genres_key, years_key, read_key = f"{key}_genres", f"{key}_years", f"{key}_read"
+    genres, bounds = service.facet_options()
+
+    # Drop choices that no longer exist before the widgets see them
+    st.session_state[genres_key] = [genre for genre in st.session_state.get(genres_key, []) if genre in genres]
+    if bounds and bounds[0] < bounds[1]:
+        low, high = st.session_state.get(years_key, bounds)
+        low, high = max(low, bounds[0]), min(high, bounds[1])
+        # A range that falls outside the years left would make the slider fail, start over
+        st.session_state[years_key] = (low, high) if low <= high else tuple(bounds)
+        years = st.session_state[years_key]
+        years = None if years == bounds else years
+    else:
+        st.session_state.pop(years_key, None)
+        years = None
+    read = READ_FILTERS[st.session_state.get(read_key, "All")]
+    counts = service.facet_counts({"genres": tuple(st.session_state[genres_key]), "years": years, "read": read})
+
+    with st.expander("Filter Books", expanded=False):
+        genre_col, year_col, read_col = st.columns([2, 2, 1])
+        with genre_col:
+            selected_genres = st.multiselect("Genre:", genres, key=genres_key,
+                                             format_func=lambda genre: f"{genre or 'No genre'} ({counts['genres'].get(genre, 0)})")
+        with year_col:
+            if bounds and bounds[0] < bounds[1]:
+                years = st.slider("Year:", min_value=bounds[0], max_value=bounds[1], key=years_key)
+                years = None if tuple(years) == bounds else tuple(years)
+        with read_col:
+            read_labels = {"All": "All", "Read": f"Read ({counts['read'][True]})",
+                           "Unread": f"{unread_label} ({counts['read'][False]})"}
+            read_choice = st.radio("Status:", list(READ_FILTERS), key=read_key, format_func=read_labels.get)
+
+    return {"genres": tuple(selected_genres), "years": years, "read": READ_FILTERS[read_choice]}
+
+# Function to render one page of books as a three-column grid.
+# Only the cards on the current page are looked up and sent to the browser.
+# Returns the filters in use, so the download section can export the same view.
+def render_book_grid(key, unread_label="Unread"):
+    with timings.span("grid/filters"):
+        filters = render_book_filters(key, unread_label)
+    sort_col, size_col, page_col = st.columns([2, 1, 1])
+    with sort_col:
+        sort_option = st.selectbox("Sort Books By:", ["Title", "Author", "Year"], key=f"{key}_sort")
+    with size_col:
+        page_size = st.selectbox("Books per page:", BOOKS_PER_PAGE_OPTIONS, key=f"{key}_page_size")
+
+    with timings.span("grid/count"):
+        total_books = service.count(filters)
+    total_pages = max(1, math.ceil(total_books / page_size))
+    page_key = f"{key}_page"
+
+    # Go back to the first page when the ordering, page size or filters change
+    cursor = (sort_option, page_size, filters)
+    if st.session_state.get(f"{key}_cursor") != cursor:
+        st.session_state[f"{key}_cursor"] = cursor
+        st.session_state[page_key] = 1
+    if st.session_state.get(page_key, 1) > total_pages:
+        st.session_state[page_key] = total_pages
+
+    with page_col:
+        page = st.number_input(f"Page (of {total_pages}):", min_value=1, max_value=total_pages, step=1, key=page_key)
+
+    start = (page - 1) * page_size
+    with timings.span("grid/page"):
+        page_books, total_books = service.page(sort_option.lower(), start, page_size, filters)
+
+    with timings.span("grid/cards"):
+        cols = st.columns(3)
+        for index, book in enumerate(page_books):
+            with cols[index % 3]:
+                render_book_card(book, unread_label)
 
+    if page_books:
+        st.caption(f"Showing {start + 1}-{start + len(page_books)} of {total_books} books")
+    else:
+        st.markdown('<div class="stError">⚠️ No books match these filters. </div>', unsafe_allow_html=True)
+    return filters
 
-# Function to convert image to Base64
-def image_to_base64(image_path):
-    with open(image_path, "rb") as img_file:
-        return base64.b64encode(img_file.read()).decode()
- 
 
+# Function to build the read/unread summary chart, cached on the numbers it shows.
+# pandas and Plotly are only imported here and in histogram_chart(), so the other
+# pages never pay for loading them.
+@st.cache_data
+def summary_chart(total_books, read_books, unread_books, read_percentage):
+    import pandas as pd
+    import plotly.express as px
 
-# Define folders
-DATA_FOLDER = "data"
-IMAGE_FOLDER = "book_images"
-LIBRARY_FILE = os.path.join(DATA_FOLDER, "library.json")
+    data = {
+        "Category": ["Total Books", "Read", "Unread", "Percentage Read"],
+        "Count": [total_books, read_books, unread_books, read_percentage]
+    }
 
-# Create folders if they don't exist
-os.makedirs(DATA_FOLDER, exist_ok=True)
-os.makedirs(IMAGE_FOLDER, exist_ok=True)
+    df = pd.DataFrame(data)
 
-# Load library from file
-def load_library():
-    if os.path.exists(LIBRARY_FILE):
-        with open(LIBRARY_FILE, "r") as file:
-            return json.load(file)
-    return []
+    fig = px.bar(df, x="Category", y="Count", text="Count", color="Category", 
+                 color_discrete_map={"Total Books": "#1E73BE", "Read": "#28A745", 
+                                     "Unread": "#DC3545", "Percentage Read": "#FFC107"})
 
-# Save library to file
-def save_library(library):
-    with open(LIBRARY_FILE, "w") as file:
-        json.dump(library, file, indent=4)
+    fig.update_traces(textposition="outside") 
+    fig.update_layout(xaxis_title="Category", yaxis_title="Value")
+    return fig
+
+# Function to build a histogram chart from (label, count) pairs, cached on its data
+@st.cache_data
+def histogram_chart(items, title, label):
+    import pandas as pd
+    import plotly.express as px
+
+    df = pd.DataFrame(items, columns=[label, "Books"])
+    fig = px.bar(df, x=label, y="Books", text="Books", title=title, color_discrete_sequence=["#d14b11"])
+    fig.update_traces(textposition="outside")
+    return fig
+
+# Function to export the library (or the books matching filters) as csv or json,
+# reusing the file written for the current version
+def export_data(fmt, filters=NO_FILTERS):
+    with timings.span(f"export/{fmt}"):
+        path = service.export(fmt, filters)
+    with open(path, "rb") as file:
+        return file.read()
+
+# Function to render one download button. A large library is first exported by a job,
+# the button appears once the file is written.
+def render_download_button(fmt, filters, mime):
+    if service.export_ready(fmt, filters) or service.count(filters) < BACKGROUND_BOOKS:
+        st.download_button(f"Download {fmt.upper()}", data=lambda: export_data(fmt, filters), file_name=f"library.{fmt}",
+                           mime=mime, key=f"download_{fmt}", width="stretch")
+    elif st.button(f"Prepare {fmt.upper()} Download", key=f"prepare_{fmt}", width="stretch"):
+        track_job(service.start_export(fmt, filters))
+        st.caption("Exporting in the background, the download button appears here when it is done.")
+
+# Function to render the CSV and JSON download tabs.
+# The buttons take a callable, so nothing is exported or sent to the browser until clicked.
+def render_download_section(filters=NO_FILTERS):
+    st.markdown("""
+        <style>
+        .stDownloadButton > button {
+            color: white !important;
+            padding: 12px 60px;
+            background: #d14b11;
+            width: 100%;
+            border: none;
+            border-radius: 10px;
+            cursor: pointer;
+            transition: transform 0.3s ease-in-out;
+            box-shadow: 0px 2px 12px rgba(245, 117, 42, 0.60);
+        }
+        .stDownloadButton > button:hover {
+            transform: scale(1.02);
+            background: #d85116 !important;
+        }
+        </style>
+    """, unsafe_allow_html=True)
+
+    # tabs for CSV and JSON download
+    tab1, tab2 = st.tabs(["CSV Download", "JSON Download"])
 
-# Load existing books
-library = load_library()
+    with tab1:
+        render_download_button("csv", filters, "text/csv")
+
+    with tab2:
+        render_download_button("json", filters, "application/json")
 
 # Set Page Config
 st.set_page_config(page_title="📚 Personal Library Manager", layout="wide")
@@ -62,7 +314,14 @@ for item in menu:
     if st.sidebar.button(item, key=item):
         st.session_state.choice = item
 
+# Hidden page, only reachable with ?diagnostics=1 in the URL. Opened on the first run
+# only, so the menu buttons still lead away from it.
+if st.query_params.get("diagnostics") == "1" and not st.session_state.get("diagnostics_opened"):
+    st.session_state.diagnostics_opened = True
+    st.session_state.choice = "Diagnostics"
+
 choice = st.session_state.choice
+run_timing = timings.start_run()
 
 
 # Custom CSS for the entire app
@@ -301,38 +560,11 @@ if choice == "Home":
         <h1 class="heading-5">Your Library</h1>
     """, unsafe_allow_html=True)
 
-    if library:
-        sort_option = st.selectbox("Sort Books By:", ["Title", "Author", "Year"])
-        sorted_books = sorted(library, key=lambda x: x[sort_option.lower()])
+    with timings.span("Home/load"):
+        has_books = service.count() > 0
 
-        cols = st.columns(3)
-
-        for index, book in enumerate(sorted_books):
-            with cols[index % 3]:
-                image_path = book["image"] if book["image"] and os.path.exists(book["image"]) else "placeholder.png"
-                
-                # Convert Image to Base64
-                img_base64 = image_to_base64(image_path)
-
-                st.markdown(
-                    f"""
-                    <div style="
-                    border-radius: 10px;
-                    padding: 20px;
-                    margin-bottom: 15px;
-                    box-shadow: 4px 4px 12px rgba(215, 176, 139, 0.96);
-                    background-color: rgb(255, 234, 223);
-                    ">
-                    <img src="data:image/png;base64,{img_base64}" width="300px" height="200px" style="border-radius: 5px; object-fit: contain;" />
-                    <h5 style="color: #000000; margin-top:10px">{book['title']}</h5>
-                    <p><strong>Author:</strong> {book['author']}</p>
-                    <p><strong>Genre:</strong> {book['genre']}</p>
-                    <p><strong>Year:</strong> {book['year']}</p>
-                    <p><strong>Status:</strong> {'Read' if book['read'] else 'Unread'}</p>
-                    </div>
-                    """,
-                    unsafe_allow_html=True
-                )
+    if has_books:
+        filters = render_book_grid("home")
 
         # Download Section Below the Books
         st.markdown("""
@@ -362,72 +594,8 @@ if choice == "Home":
            <h1 class="heading-2">Download Library</h1>
         """, unsafe_allow_html=True)
 
-        # Convert Library Data to DataFrame
-        df = pd.DataFrame(library)
-
-        # Convert DataFrame to CSV
-        csv = df.to_csv(index=False).encode("utf-8")
-
-        # Convert Library Data to JSON
-        json_data = json.dumps(library, indent=4).encode("utf-8")
-
-        # tabs for CSV and JSON download
-        tab1, tab2 = st.tabs(["CSV Download", "JSON Download"])
-
-        with tab1:
-            st.markdown(
-                f"""
-                <a href="data:text/csv;base64,{base64.b64encode(csv).decode()}" download="library.csv">
-                    <button style="
-                    color: white !important;
-                    padding: 12px 60px;
-                    background: #d14b11;
-                    width: 100%;
-                    border: none;
-                    border-radius: 10px;
-                    cursor: pointer;
-                    transition: transform 0.3s ease-in-out;
-                    box-shadow: 0px 2px 12px rgba(245, 117, 42, 0.60);">
-                    Download CSV
-                    </button>
-                </a>
-                <style>
-                a:hover button {{
-                    transform: scale(1.02);
-                    background: #d85116 !important;
-                }}
-                </style>
-                """,
-                unsafe_allow_html=True
-            )
-
-        with tab2:
-            st.markdown(
-                f"""
-                <a href="data:application/json;base64,{base64.b64encode(json_data).decode()}" download="library.json">
-                    <button style="
-                    color: white !important;
-                    padding: 12px 60px;
-                    background: #d14b11;
-                    width: 100%;
-                    margin-top: 20px;
-                    border: none;
-                    border-radius: 10px; 
-                    cursor: pointer;
-                    transition: transform 0.3s ease-in-out;
-                    box-shadow: 0px 2px 12px rgba(245, 117, 42, 0.60);">
-                    Download JSON
-                    </button>
-                </a>
-                <style>
-                a:hover button {{
-                    transform: scale(1.02);
-                    background: #d85116 !important;
-                }}
-                </style>
-                """,
-                unsafe_allow_html=True
-            )
+        # Export files are only generated when a download button is clicked
+        render_download_section(filters)
 
     else:
         st.markdown('<div class="stError">⚠️ No books in your library. </div>', unsafe_allow_html=True)
@@ -468,26 +636,35 @@ elif choice == "Add a Book":
     
     if st.button("Add Book"):
         if title and author and year.isdigit() and uploaded_image:
-            from PIL import Image
-            image = Image.open(uploaded_image)  
-            image = image.resize((200, 200))  
-            image_path = os.path.join(IMAGE_FOLDER, f"{title.replace(' ', '_')}.png")
-            image.save(image_path)  
-            
             new_book = {
                 "title": title,
                 "author": author,
                 "year": int(year),  
                 "genre": genre,
-                "read": read_status == "Yes",
-                "image": image_path
+                "read": read_status == "Yes"
             }
-            library.append(new_book)
-            save_library(library)
-            st.markdown(f"<div class='stSuccess'>✔ Your '{title}' book added to your library. </div>", unsafe_allow_html=True)
+            try:
+                with timings.span("Add a Book/add"):
+                    service.add(new_book, cover_upload(uploaded_image))
+            except ValueError as error:
+                st.markdown(f'<div class="stError">⚠️ {error} </div>', unsafe_allow_html=True)
+            else:
+                st.markdown(f"<div class='stSuccess'>✔ Your '{title}' book added to your library. </div>", unsafe_allow_html=True)
         else:
             st.markdown('<div class="stError">⚠️ Please enter all required fields correctly. </div>', unsafe_allow_html=True)
 
+    # Bulk import as a background job, everything is written in one go at the end.
+    # Progress, cancelling and the result are in the jobs panel of the sidebar.
+    with st.expander("Import Many Books (CSV, JSON or Goodreads export)"):
+        import_file = st.file_uploader("Upload a CSV or JSON file", type=["csv", "json"], key="import_file")
+        if st.button("Import Books"):
+            if import_file is None:
+                st.markdown('<div class="stError">⚠️ Please upload a file to import. </div>', unsafe_allow_html=True)
+            else:
+                with timings.span("Add a Book/import"):
+                    track_job(service.start_import(import_file))
+                st.markdown("<div class='stSuccess'>⏳ Importing in the background, follow it in the sidebar. </div>", unsafe_allow_html=True)
+
 
 # Display All Books
 elif choice == "Display All Books":
@@ -516,38 +693,11 @@ elif choice == "Display All Books":
         <h1 class="heading-1">Your Library</h1>
     """, unsafe_allow_html=True)
 
-    if library:
-        sort_option = st.selectbox("Sort Books By:", ["Title", "Author", "Year"])
-        sorted_books = sorted(library, key=lambda x: x[sort_option.lower()])
+    with timings.span("Display All Books/load"):
+        has_books = service.count() > 0
 
-        cols = st.columns(3)
-
-        for index, book in enumerate(sorted_books):
-            with cols[index % 3]:
-                image_path = book["image"] if book["image"] and os.path.exists(book["image"]) else "placeholder.png"
-                
-                # Convert Image to Base64
-                img_base64 = image_to_base64(image_path)
-
-                st.markdown(
-                    f"""
-                    <div style="
-                    border-radius: 10px;
-                    padding: 20px;
-                    margin-bottom: 15px;
-                    box-shadow: 4px 4px 12px rgba(215, 176, 139, 0.96);
-                    background-color: rgb(255, 234, 223);
-                    ">
-                    <img src="data:image/png;base64,{img_base64}" width="300px" height="200px" style="border-radius: 5px; object-fit: contain;" />
-                    <h5 style="color: #000000; margin-top:10px">{book['title']}</h4>
-                    <p><strong>Author:</strong> {book['author']}</p>
-                    <p><strong>Genre:</strong> {book['genre']}</p>
-                    <p><strong>Year:</strong> {book['year']}</p>
-                    <p><strong>Status:</strong> {'Read' if book['read'] else 'To Read'}</p>
-                    </div>
-                    """,
-                    unsafe_allow_html=True
-                )
+    if has_books:
+        filters = render_book_grid("display", unread_label="To Read")
 
         # Download Section Below the Books
         st.markdown("""
@@ -577,72 +727,8 @@ elif choice == "Display All Books":
            <h1 class="heading-2">Download Library</h1>
         """, unsafe_allow_html=True)
 
-        # Convert Library Data to DataFrame
-        df = pd.DataFrame(library)
-
-        # Convert DataFrame to CSV
-        csv = df.to_csv(index=False).encode("utf-8")
-
-        # Convert Library Data to JSON
-        json_data = json.dumps(library, indent=4).encode("utf-8")
-
-        # tabs for CSV and JSON download
-        tab1, tab2 = st.tabs(["CSV Download", "JSON Download"])
-
-        with tab1:
-            st.markdown(
-                f"""
-                <a href="data:text/csv;base64,{base64.b64encode(csv).decode()}" download="library.csv">
-                    <button style="
-                    color: white !important;
-                    padding: 12px 60px;
-                    background: #d14b11;
-                    width: 100%;
-                    border: none;
-                    border-radius: 10px;
-                    cursor: pointer;
-                    transition: transform 0.3s ease-in-out;
-                    box-shadow: 0px 2px 12px rgba(245, 117, 42, 0.60);">
-                    Download CSV
-                    </button>
-                </a>
-                <style>
-                a:hover button {{
-                    transform: scale(1.02);
-                    background: #d85116 !important;
-                }}
-                </style>
-                """,
-                unsafe_allow_html=True
-            )
-
-        with tab2:
-            st.markdown(
-                f"""
-                <a href="data:application/json;base64,{base64.b64encode(json_data).decode()}" download="library.json">
-                    <button style="
-                    color: white !important;
-                    padding: 12px 60px;
-                    background: #d14b11;
-                    width: 100%;
-                    margin-top: 20px;
-                    border: none;
-                    border-radius: 10px; 
-                    cursor: pointer;
-                    transition: transform 0.3s ease-in-out;
-                    box-shadow: 0px 2px 12px rgba(245, 117, 42, 0.60);">
-                    Download JSON
-                    </button>
-                </a>
-                <style>
-                a:hover button {{
-                    transform: scale(1.02);
-                    background: #d85116 !important;
-                }}
-                </style>
-                """,
-                unsafe_allow_html=True
-            )
+        # Export files are only generated when a download button is clicked
+        render_download_section(filters)
 
     else:
         st.markdown('<div class="stError">⚠️ No books in your library. </div>', unsafe_allow_html=True)
@@ -674,11 +760,15 @@ elif choice == "Edit a Book":
         
         <h1 class="heading-1">Edit a Book</h1>
     """, unsafe_allow_html=True)
-    book_titles = [book["title"] for book in library]
+    with timings.span("Edit a Book/labels"):
+        book_labels = service.labels()
 
-    if book_titles:
-        book_to_edit = st.selectbox("Select a book to edit:", book_titles)
-        book = next((b for b in library if b["title"] == book_to_edit), None)
+    if book_labels:
+        book_id = st.selectbox("Select a book to edit:", list(book_labels), format_func=book_labels.get)
+        book = service.get(book_id)
+        # The version this session last showed, an update made on top of it is refused
+        # if someone else saved the book in between
+        seen_id, seen_version = st.session_state.get("edit_seen", (None, None))
 
         if book:
             title = st.text_input("Title:", book["title"])
@@ -689,22 +779,37 @@ elif choice == "Edit a Book":
             uploaded_image = st.file_uploader("Upload New Book Cover", type=["jpg", "png", "jpeg"])
 
             if st.button("Update Book"):
-                if uploaded_image is not None:
-                    image = Image.open(uploaded_image)  
-                    image = image.resize((200, 200))  
-                    image_path = os.path.join(IMAGE_FOLDER, f"{title.replace(' ', '_')}.png")
-                    image.save(image_path)  
-                    book["image"] = image_path  
-
-                book.update({
-                    "title": title,
-                    "author": author,
-                    "year": year,
-                    "genre": genre,
-                    "read": True if read_status == "Yes" else False
-                })
-                save_library(library)
-                st.markdown(f"<div class='stSuccess'>'{title}'✔ Updated Seccessfully</div>", unsafe_allow_html=True)
+                if seen_id != book_id:
+                    # The selection moved under the user because the list of books changed
+                    st.markdown('<div class="stError">⚠️ The list of books changed while you were editing, '
+                                'nothing was saved. Check the book and make your changes again. </div>', unsafe_allow_html=True)
+                else:
+                    changes = {
+                        "title": title,
+                        "author": author,
+                        "year": year,
+                        "genre": genre,
+                        "read": True if read_status == "Yes" else False
+                    }
+                    cover = cover_upload(uploaded_image) if uploaded_image is not None else None
+
+                    try:
+                        with timings.span("Edit a Book/update"):
+                            book = service.update(book_id, changes, seen_version, cover)
+                    except ConflictError as error:
+                        book = error.book
+                        if book is None:
+                            st.markdown('<div class="stError">⚠️ Someone else removed this book while you were editing it. </div>', unsafe_allow_html=True)
+                        else:
+                            st.markdown('<div class="stError">⚠️ Someone else changed this book while you were editing it, '
+                                        'nothing was saved. Check the latest version and make your changes again. </div>', unsafe_allow_html=True)
+                    except ValueError as error:
+                        st.markdown(f'<div class="stError">⚠️ {error} </div>', unsafe_allow_html=True)
+                    else:
+                        st.markdown(f"<div class='stSuccess'>'{title}'✔ Updated Seccessfully</div>", unsafe_allow_html=True)
+
+            if book is not None:
+                st.session_state["edit_seen"] = (book_id, book["version"])
     else:
         st.markdown('<div class="stError">⚠️ No books to edit. </div>', unsafe_allow_html=True)
         
@@ -735,41 +840,24 @@ elif choice == "Search for a Book":
         
         <h1 class="heading-1">Search for a Book</h1>
     """, unsafe_allow_html=True)
-    search_type = st.radio("Search by:", ["Title", "Author"])
+    search_type = st.radio("Search by:", ["Title", "Author", "Genre"])
+    match_mode = st.radio("Match:", ["Contains", "Starts with", "Fuzzy"], horizontal=True)
     query = st.text_input(f"Enter {search_type}:")
 
     if st.button("Search"):
         if query.strip() == "":
             st.markdown(f'<div class="stError">⚠️ Please enter a {search_type.lower()} to find your book. </div>', unsafe_allow_html=True)
         else:
-            results = [book for book in library if query.lower() in book[search_type.lower()].lower()]
+            # Fuzzy puts the best matches first and tolerates typos
+            mode = {"Contains": "substring", "Starts with": "prefix", "Fuzzy": "fuzzy"}[match_mode]
+            with timings.span("Search for a Book/query"):
+                results = service.search(query, search_type.lower(), mode)
             if results:
-                cols = st.columns(3)  
-                for index, book in enumerate(results):
-                    with cols[index % 3]:  
-                        image_path = book["image"] if book["image"] and os.path.exists(book["image"]) else "placeholder.png"
-                        
-                        # Convert Image to Base64
-                        img_base64 = image_to_base64(image_path)
-
-                        st.markdown(
-                            f"""
-                            <div style="
-                               border-radius: 10px;
-                               padding: 20px;
-                               margin-bottom: 15px;
-                               box-shadow: 4px 4px 12px rgba(215, 176, 139, 0.96);
-                               background-color: rgb(255, 234, 223);">
-                                <img src="data:image/png;base64,{img_base64}" width="300px" height="200px" style="border-radius: 5px; object-fit: contain;" />
-                                <h5 style="color: #000000; margin-top: 10px;">{book['title']}</h5>
-                                <p><strong>Author:</strong> {book['author']}</p>
-                                <p><strong>Genre:</strong> {book['genre']}</p>
-                                <p><strong>Year:</strong> {book['year']}</p>
-                                <p><strong>Status:</strong> {'Read' if book['read'] else 'To Read'}</p>
-                            </div>
-                            """,
-                            unsafe_allow_html=True
-                        )
+                with timings.span("Search for a Book/cards"):
+                    cols = st.columns(3)
+                    for index, book in enumerate(results):
+                        with cols[index % 3]:
+                            render_book_card(book, unread_label="To Read")
             else:
                 st.markdown('<div class="stError">⚠️ No matching books found. </div>', unsafe_allow_html=True)
 
@@ -817,44 +905,51 @@ elif choice == "Statistics":
        </style>
     """, unsafe_allow_html=True)
 
-    total_books = len(library)
-    read_books = sum(1 for book in library if book["read"])
-    unread_books = total_books - read_books
-    read_percentage = (read_books / total_books) * 100 if total_books > 0 else 0
+    # Counters are maintained on every add/edit/remove, nothing is recounted here
+    if not service.stats_ready() and service.count() >= BACKGROUND_BOOKS:
+        # Building the statistics of a large library takes a while, do it as a job
+        track_job(service.start_stats())
+        st.markdown('<div class="stSuccess">⏳ Counting your books, the statistics appear here when they are ready. </div>', unsafe_allow_html=True)
+    else:
+        with timings.span("Statistics/summary"):
+            summary = service.stats()
+        total_books = summary["total_books"]
+        read_books = summary["read_books"]
+        unread_books = summary["unread_books"]
+        read_percentage = summary["read_percentage"]
 
-    col1, col2, col3, col4 = st.columns(4)
+        col1, col2, col3, col4 = st.columns(4)
 
-    with col1:
-        st.markdown("<p style='text-align: center;'>Total Books</p>", unsafe_allow_html=True)
-        st.markdown(f"<h3 style='color: #1E73BE; text-align: center;'>{total_books}</h3>", unsafe_allow_html=True)
+        with col1:
+            st.markdown("<p style='text-align: center;'>Total Books</p>", unsafe_allow_html=True)
+            st.markdown(f"<h3 style='color: #1E73BE; text-align: center;'>{total_books}</h3>", unsafe_allow_html=True)
 
-    with col2:
-        st.markdown("<p style='text-align: center;'>Read</p>", unsafe_allow_html=True)
-        st.markdown(f"<h3 style='color: #28A745; text-align: center;'>{read_books}</h3>", unsafe_allow_html=True)
+        with col2:
+            st.markdown("<p style='text-align: center;'>Read</p>", unsafe_allow_html=True)
+            st.markdown(f"<h3 style='color: #28A745; text-align: center;'>{read_books}</h3>", unsafe_allow_html=True)
 
-    with col3:
-        st.markdown("<p style='text-align: center;'>Unread</p>", unsafe_allow_html=True)
-        st.markdown(f"<h3 style='color: #DC3545; text-align: center;'>{unread_books}</h3>", unsafe_allow_html=True)
+        with col3:
+            st.markdown("<p style='text-align: center;'>Unread</p>", unsafe_allow_html=True)
+            st.markdown(f"<h3 style='color: #DC3545; text-align: center;'>{unread_books}</h3>", unsafe_allow_html=True)
 
-    with col4:
-        st.markdown("<p style='text-align: center;'>Percentage Read</p>", unsafe_allow_html=True)
-        st.markdown(f"<h3 style='color: #FFC107; text-align: center;'>{read_percentage:.2f}%</h3>", unsafe_allow_html=True)
+        with col4:
+            st.markdown("<p style='text-align: center;'>Percentage Read</p>", unsafe_allow_html=True)
+            st.markdown(f"<h3 style='color: #FFC107; text-align: center;'>{read_percentage:.2f}%</h3>", unsafe_allow_html=True)
 
-    data = {
-        "Category": ["Total Books", "Read", "Unread", "Percentage Read"],
-        "Count": [total_books, read_books, unread_books, read_percentage]
-    }
+        with timings.span("Statistics/charts"):
+            st.plotly_chart(summary_chart(total_books, read_books, unread_books, read_percentage))
 
-    df = pd.DataFrame(data)
+            genre_col, decade_col = st.columns(2)
 
-    fig = px.bar(df, x="Category", y="Count", text="Count", color="Category", 
-                 color_discrete_map={"Total Books": "#1E73BE", "Read": "#28A745", 
-                                     "Unread": "#DC3545", "Percentage Read": "#FFC107"})
+            with genre_col:
+                genres = [(genre or "No genre", count) for genre, count in summary["genres"]]
+                st.plotly_chart(histogram_chart(genres, "Top Genres", "Genre"))
 
-    fig.update_traces(textposition="outside") 
-    fig.update_layout(xaxis_title="Category", yaxis_title="Value")
+            with decade_col:
+                decades = [(f"{decade}s", count) for decade, count in summary["decades"]]
+                st.plotly_chart(histogram_chart(decades, "Books per Decade", "Decade"))
 
-    st.plotly_chart(fig)                
+            st.plotly_chart(histogram_chart(summary["authors"], "Top Authors", "Author"))
       
                         
 # Remove a Book
@@ -883,14 +978,66 @@ elif choice == "Remove a Book":
         
         <h1 class="heading-1">Remove a Book</h1>
     """, unsafe_allow_html=True)
-    book_titles = [book["title"] for book in library]
-
-    if book_titles:
-        book_to_remove = st.selectbox("Select a book to remove:", book_titles)
+    if "remove_message" in st.session_state:
+        st.markdown(f"<div class='stSuccess'>{st.session_state.pop('remove_message')} </div>", unsafe_allow_html=True)
+    with timings.span("Remove a Book/labels"):
+        book_labels = service.labels()
+
+    if book_labels:
+        book_id = st.selectbox("Select a book to remove:", list(book_labels), format_func=book_labels.get)
+        # As on the Edit page, a book someone else changed since it was shown is not removed
+        seen_id, seen_version = st.session_state.get("remove_seen", (None, None))
         if st.button("Remove Book"):
-            library = [book for book in library if book["title"] != book_to_remove]
-            save_library(library)
-            st.markdown(f"<div class='stSuccess'>✔ Your '{book_to_remove}' book removed from your library. </div>", unsafe_allow_html=True)
+            if seen_id != book_id:
+                # The selection moved under the user because the list of books changed
+                st.markdown('<div class="stError">⚠️ The list of books changed, nothing was removed. '
+                            'Check the selected book and remove it again. </div>', unsafe_allow_html=True)
+            else:
+                try:
+                    with timings.span("Remove a Book/remove"):
+                        removed_book = service.remove(book_id, seen_version)
+                except ConflictError as error:
+                    if error.book is None:
+                        st.markdown('<div class="stError">⚠️ Someone else already removed this book. </div>', unsafe_allow_html=True)
+                    else:
+                        st.markdown(f"<div class='stError'>⚠️ Someone else changed '{error.book['title']}' just now, "
+                                    "it was not removed. Check it and remove it again if you still want to. </div>", unsafe_allow_html=True)
+                else:
+                    # Rerun so the picker and the recorded version follow the shorter list
+                    st.session_state["remove_message"] = f"✔ Your '{removed_book['title']}' book removed from your library."
+                    st.rerun()
+        book = service.get(book_id)
+        st.session_state["remove_seen"] = (book_id, book["version"]) if book else (None, None)
     else:
         st.markdown('<div class="stError">⚠️ No books in the library. </div>', unsafe_allow_html=True)
 
+
+# Diagnostics (hidden, open with ?diagnostics=1)
+elif choice == "Diagnostics":
+    st.markdown("<h1>Diagnostics</h1>", unsafe_allow_html=True)
+    timings.enabled = st.toggle("Record page timings", value=timings.enabled)
+    st.caption(f"Rolling percentiles over the last {timings.window} runs of each span, "
+               f"also served as JSON at app/static/diagnostics.json")
+
+    summary = timings.summary()
+    if summary:
+        st.dataframe([{"span": name, **{key: round(value, 3) for key, value in stats.items()}} for name, stats in summary.items()],
+                     width="stretch", hide_index=True)
+    else:
+        st.markdown('<div class="stError">⚠️ No timings recorded yet. </div>', unsafe_allow_html=True)
+
+    json_col, reset_col = st.columns(2)
+    with json_col:
+        st.download_button("Download JSON", data=timings.to_json(), file_name="diagnostics.json",
+                           mime="application/json", width="stretch")
+    with reset_col:
+        if st.button("Reset Timings", width="stretch"):
+            timings.reset()
+            st.rerun()
+
+# Jobs panel, after the page so it includes jobs the page just started
+with st.sidebar:
+    active_jobs = [job for job in service.jobs.get_many(st.session_state.get("job_ids", [])) if not job.finished]
+    st.fragment(render_jobs_panel, run_every=JOB_POLL_SECONDS if active_jobs else None)()
+
+timings.finish_run(choice, run_timing)
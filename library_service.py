@@ -0,0 +1,263 @@
+import io
+import os
+import threading
+
+from catalog import ConflictError
+from cover_images import CoverProcessor
+from cover_store import CoverStore
+from export import export_library, export_path, export_version
+from facet_index import NO_FILTERS, bitmap_ids, filters_active
+from importer import import_books, import_upload
+from jobs import JobQueue
+from search_index import SEARCH_FIELDS
+from shared_library import SharedLibrary
+from sorted_views import SORT_FIELDS
+from storage import open_storage
+
+
+DATA_FOLDER = "data"
+IMAGE_FOLDER = "book_images"
+DEFAULT_BACKEND = "sqlite"
+
+# Tries at building an index that writes keep making stale
+BUILD_ATTEMPTS = 3
+
+
+# Check the fields of a new or edited book, raises ValueError with a message for the user
+def validate_book(book):
+    for field in ("title", "author"):
+        if field in book and not str(book[field]).strip():
+            raise ValueError(f"{field} is required")
+    if "year" in book and not str(book["year"]).strip().lstrip("-").isdigit():
+        raise ValueError("year must be a number")
+
+
+# The library without any UI: books, covers, search, browsing, statistics, import and export.
+# The Streamlit app is one client; the CLI tools, benchmarks and batch jobs can use it directly.
+# Importing it does not pull in Streamlit, Plotly or pandas.
+# Methods return plain dict copies of books, safe to keep and modify.
+# Pass the "version" of the book you showed to update() or remove(), and ConflictError
+# tells you when someone else changed it first.
+# Slow work (bulk import, large exports, building the indexes) can run as jobs on
+# self.jobs instead: the start_*() methods return a job id to follow and cancel.
+class LibraryService:
+    def __init__(self, data_folder=DATA_FOLDER, image_folder=IMAGE_FOLDER, backend=None):
+        self.data_folder = data_folder
+        self.export_folder = os.path.join(data_folder, "exports")
+        os.makedirs(data_folder, exist_ok=True)
+        backend = backend or os.environ.get("LIBRARY_BACKEND", DEFAULT_BACKEND)
+        self.storage = open_storage(backend, data_folder)
+        self.covers = CoverStore(image_folder)
+        # One index file per backend, their generations are unrelated counters
+        index_path = os.path.join(data_folder, f"search_index.{backend}.pickle")
+        self.library = SharedLibrary(self.storage, index_path, self.covers)
+        self._cover_processor = None
+        self._cover_processor_lock = threading.Lock()
+        self.jobs = JobQueue()
+
+    # Number of books, or of books matching filters
+    def count(self, filters=NO_FILTERS):
+        with self.library.read() as catalog:
+            if filters_active(filters):
+                return self.library.facets().mask(**filters).bit_count()
+            return len(catalog)
+
+    def get(self, book_id):
+        return self.library.get(book_id)
+
+    def get_many(self, book_ids):
+        return self.library.get_many(book_ids)
+
+    # Add a book and return it with its new id. The year is stored as an int.
+    # cover, if given, is (image bytes, extension) and becomes the book's image.
+    def add(self, book, cover=None):
+        validate_book(book)
+        book = dict(book, year=int(book["year"]))
+        covers = ()
+        if cover is not None:
+            book["image"], covers = self._stage_cover(*cover)
+        return dict(self.library.add(book, covers))
+
+    # Apply changes to a book and return the updated copy, cover as for add()
+    def update(self, book_id, changes, expected_version=None, cover=None):
+        validate_book(changes)
+        if "year" in changes:
+            changes = dict(changes, year=int(changes["year"]))
+        covers = ()
+        if cover is not None:
+            changes = dict(changes)
+            changes["image"], covers = self._stage_cover(*cover)
+        return dict(self.library.update(book_id, changes, expected_version, covers))
+
+    # Remove a book and return it
+    def remove(self, book_id, expected_version=None):
+        return dict(self.library.remove(book_id, expected_version))
+
+    # {id: "title — author (year) #id"} for every book, for pickers
+    def labels(self):
+        with self.library.read() as catalog:
+            return {book["id"]: book_label(book) for book in catalog}
+
+    # Store cover image bytes and return the path to put in the book's "image".
+    # Thumbnails of a new image are made in the background; a known image is reused.
+    # Until a book uses it the file may be deleted again, add(cover=...) is safe from that.
+    def save_cover(self, data, extension=".png"):
+        image_path, created = self.covers.put_bytes(data, extension.lower() or ".png")
+        if created:
+            self.cover_processor().submit(image_path)
+        return image_path
+
+    # Store a cover for a coming write, with the (path, restore) pair that lets the write
+    # put it back if another write deleted the file meanwhile
+    def _stage_cover(self, data, extension):
+        image_path = self.save_cover(data, extension)
+        return image_path, [(image_path, lambda: self.save_cover(data, extension))]
+
+    # Process pool for thumbnails, started on first use
+    def cover_processor(self):
+        with self._cover_processor_lock:
+            if self._cover_processor is None:
+                self._cover_processor = CoverProcessor()
+            return self._cover_processor
+
+    # One page of books in the given order, with the total number of matching books.
+    # filters take the FacetIndex keys: genres, years (low, high) and read.
+    def page(self, sort_field="title", start=0, count=12, filters=NO_FILTERS):
+        if sort_field not in SORT_FIELDS:
+            raise ValueError(f"Unknown sort field: {sort_field}")
+        with self.library.read() as catalog:
+            views = self.library.sorted_views()
+            if filters_active(filters):
+                selection = views.select(sort_field, self.library.facets().mask(**filters))
+                total, page_ids = len(selection), selection[start:start + count]
+            else:
+                total, page_ids = len(catalog), views.page(sort_field, start, count)
+        return self.get_many(page_ids), total
+
+    # Every genre and the (lowest, highest) year, for the filter widgets
+    def facet_options(self):
+        with self.library.read():
+            facets = self.library.facets()
+            return facets.genres(), facets.year_bounds()
+
+    # Matching books per genre and read status under filters, see FacetIndex.counts()
+    def facet_counts(self, filters=NO_FILTERS):
+        with self.library.read():
+            return self.library.facets().counts(**filters)
+
+    # Books matching query in one field, mode "substring", "prefix" or "fuzzy" (best first)
+    def search(self, query, field="title", mode="substring"):
+        if field not in SEARCH_FIELDS:
+            raise ValueError(f"Unknown search field: {field}")
+        with self.library.read():
+            index = self.library.search_index()
+            if mode == "fuzzy":
+                result_ids = [book_id for book_id, score in index.fuzzy_search(query, fields=(field,))]
+            else:
+                result_ids = sorted(index.search(query, field, mode))
+        return self.get_many(result_ids)
+
+    def stats(self, top=10):
+        with self.library.read():
+            return self.library.stats().summary(top)
+
+    # Whether stats() can answer without building anything first
+    def stats_ready(self):
+        return self.library.ready("stats")
+
+    # Build every index that isn't current, as a job. Returns the job id.
+    def start_indexing(self):
+        return self.jobs.submit("Build indexes", self._build_indexes, key="indexes")
+
+    # Build only the statistics, as a job, for a page that needs nothing else. Returns the job id.
+    def start_stats(self):
+        return self.jobs.submit("Build statistics", self._build_stats, key="stats")
+
+    def _build_stats(self, job):
+        job.report(0, "Building the statistics")
+        for attempt in range(BUILD_ATTEMPTS):
+            if self.library.build("stats"):
+                break
+        job.message = "Ready"
+
+    # Each index is built without holding the library lock, see SharedLibrary.build().
+    # One that a write made stale meanwhile is tried again, then left to build on first use.
+    def _build_indexes(self, job):
+        steps = [("search index", "search_index"), ("sort orders", "sorted_views"),
+                 ("filters", "facets"), ("statistics", "stats")]
+        for done, (label, name) in enumerate(steps):
+            for attempt in range(BUILD_ATTEMPTS):
+                job.report(done / len(steps), f"Building the {label}")
+                if self.library.build(name):
+                    break
+        job.message = "Ready"
+
+    # Write the library, or the books matching filters, as csv or json and return the file path.
+    # The file is reused until the library or the filters change.
+    def export(self, fmt, filters=NO_FILTERS, progress=None):
+        with self.library.read() as catalog:
+            if filters_active(filters):
+                books = [catalog.get(book_id) for book_id in bitmap_ids(self.library.facets().mask(**filters))]
+            else:
+                books = catalog.books
+            generation, filters_tag = self._export_version(filters)
+        return export_library(books, fmt, self.export_folder, generation, filters_tag, progress)
+
+    # Path of the export export() would return if it is already written, else None
+    def export_ready(self, fmt, filters=NO_FILTERS):
+        with self.library.read():
+            path = export_path(fmt, self.export_folder, *self._export_version(filters))
+        return path if os.path.exists(path) else None
+
+    # export() as a job, the job result is the file path. Returns the job id.
+    def start_export(self, fmt, filters=NO_FILTERS):
+        return self.jobs.submit(f"{fmt.upper()} export", self._export_job, fmt, filters,
+                                key=("export", fmt, repr(filters)))
+
+    def _export_job(self, job, fmt, filters):
+        path = self.export(fmt, filters, progress=job.report)
+        job.message = "Ready to download"
+        return path
+
+    # Tags for the file name: the library generation, and the filters or "all"
+    def _export_version(self, filters):
+        filters_tag = export_version(filters) if filters_active(filters) else "all"
+        return export_version(self.library.generation), filters_tag
+
+    # Import books from a CSV or JSON text stream, see importer.import_books()
+    def import_books(self, text_file, fmt):
+        return import_books(text_file, fmt, self.library, self.covers, self.cover_processor())
+
+    # Import an uploaded (binary) file, the format comes from its name
+    def import_upload(self, uploaded_file, progress=None):
+        return import_upload(uploaded_file, self.library, self.covers, self.cover_processor(), progress)
+
+    # import_upload() as a job, on a copy of the file so the caller can let go of it.
+    # The job result is the import summary. Returns the job id.
+    def start_import(self, uploaded_file):
+        copy = io.BytesIO(uploaded_file.getvalue())
+        copy.name = uploaded_file.name
+        return self.jobs.submit(f"Import {uploaded_file.name}", self._import_job, copy)
+
+    def _import_job(self, job, uploaded_file):
+        result = self.import_upload(uploaded_file, lambda fraction, rows: job.report(fraction, f"{rows:,} rows read"))
+        job.message = (f"Imported {result['imported']} books, skipped {result['duplicates']} duplicates "
+                       f"and {result['invalid']} invalid rows.")
+        return result
+
+    # Cancel running jobs, wait for queued thumbnails, save the search index and release
+    # the worker processes
+    def close(self):
+        self.jobs.shutdown(cancel=True)
+        self.library.close()
+        with self._cover_processor_lock:
+            if self._cover_processor is not None:
+                self._cover_processor.shutdown()
+                self._cover_processor = None
+        if hasattr(self.storage, "close"):
+            self.storage.close()
+
+
+# Label of a book in pickers, the id keeps duplicate titles apart
+def book_label(book):
+    return f"{book['title']} — {book['author']} ({book['year']}) #{book['id']}"
@@ -0,0 +1,90 @@
+import threading
+from collections import Counter
+
+
+# What a single book adds to the counters
+def _contribution(book):
+    return (bool(book["read"]), book.get("genre", ""), book["author"], int(book["year"]) // 10 * 10)
+
+
+# Library statistics kept up to date one book at a time.
+# Adding, editing or removing a book adjusts the counters instead of recounting,
+# so the Statistics page reads ready-made totals and histograms.
+class LibraryStats:
+    def __init__(self):
+        self.generation = None
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._contributions = {}
+        self.read_books = 0
+        self.genres = Counter()
+        self.authors = Counter()
+        self.decades = Counter()
+
+    @property
+    def total_books(self):
+        return len(self._contributions)
+
+    @property
+    def unread_books(self):
+        return self.total_books - self.read_books
+
+    @property
+    def read_percentage(self):
+        return (self.read_books / self.total_books) * 100 if self.total_books > 0 else 0
+
+    # Replace the counters with the given books
+    def rebuild(self, books, generation=None):
+        with self._lock:
+            self._reset()
+            for book in books:
+                self._add(book)
+            self.generation = generation
+
+    def add(self, book):
+        with self._lock:
+            self._add(book)
+
+    def update(self, book):
+        with self._lock:
+            self._remove(book["id"])
+            self._add(book)
+
+    def remove(self, book_id):
+        with self._lock:
+            self._remove(book_id)
+
+    # Plain copy of the current numbers, with the top genres and authors
+    def summary(self, top=10):
+        with self._lock:
+            return {
+                "total_books": self.total_books,
+                "read_books": self.read_books,
+                "unread_books": self.unread_books,
+                "read_percentage": self.read_percentage,
+                "genres": self.genres.most_common(top),
+                "authors": self.authors.most_common(top),
+                "decades": sorted(self.decades.items()),
+            }
+
+    def _add(self, book):
+        if book["id"] in self._contributions:
+            self._remove(book["id"])
+        contribution = _contribution(book)
+        self._contributions[book["id"]] = contribution
+        self._count(contribution, 1)
+
+    def _remove(self, book_id):
+        contribution = self._contributions.pop(book_id, None)
+        if contribution is not None:
+            self._count(contribution, -1)
+
+    def _count(self, contribution, step):
+        read, genre, author, decade = contribution
+        self.read_books += step if read else 0
+        for counter, key in ((self.genres, genre), (self.authors, author), (self.decades, decade)):
+            counter[key] += step
+            if counter[key] <= 0:
+                del counter[key]
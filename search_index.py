@@ -0,0 +1,285 @@
+import bisect
+import heapq
+import os
+import pickle
+import re
+import threading
+
+
+# Fields that can be searched
+SEARCH_FIELDS = ("title", "author", "genre")
+
+# Bump when the pickled layout changes so old snapshots are rebuilt
+INDEX_FORMAT = 1
+
+GRAM_SIZE = 3
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# Share of the query's trigrams a value must contain to count as a fuzzy match
+FUZZY_THRESHOLD = 0.5
+
+# save_later() writes the index SAVE_DELAY seconds after the first unsaved change,
+# or at once when SAVE_EVERY changes are waiting
+SAVE_DELAY = 60
+SAVE_EVERY = 1000
+
+
+# Case-fold a field value the same way for indexing and querying
+def normalize(value):
+    return str(value).casefold().strip()
+
+
+def tokenize(value):
+    return TOKEN_PATTERN.findall(value)
+
+
+def ngrams(value, size=GRAM_SIZE):
+    return {value[i:i + size] for i in range(len(value) - size + 1)}
+
+
+# Inverted index over the title, author and genre of every book.
+# Distinct field values are indexed by trigram (substring search) and by word
+# (prefix search), and each value maps to the ids of the books that have it.
+# Queries only touch the candidate values, never the whole library.
+class SearchIndex:
+    def __init__(self):
+        self.generation = None
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._unsaved = 0
+        self._save_timer = None
+        self._reset()
+
+    def _reset(self):
+        self._docs = {}
+        self._postings = {field: {} for field in SEARCH_FIELDS}
+        self._grams = {field: {} for field in SEARCH_FIELDS}
+        self._tokens = {field: {} for field in SEARCH_FIELDS}
+        self._sorted_tokens = {field: [] for field in SEARCH_FIELDS}
+
+    def __len__(self):
+        return len(self._docs)
+
+    # Replace the index contents with the given books
+    def rebuild(self, books, generation=None):
+        with self._lock:
+            self._reset()
+            for book in books:
+                self._add(book)
+            self.generation = generation
+
+    def add(self, book):
+        with self._lock:
+            self._add(book)
+
+    def update(self, book):
+        with self._lock:
+            self._remove(book["id"])
+            self._add(book)
+
+    def remove(self, book_id):
+        with self._lock:
+            self._remove(book_id)
+
+    # Return the ids of books whose field contains the query ("substring")
+    # or has words starting with every word of the query ("prefix")
+    def search(self, query, field, mode="substring"):
+        query = normalize(query)
+        if not query:
+            return set()
+        with self._lock:
+            if mode == "prefix":
+                values = self._prefix_values(field, query)
+            else:
+                values = self._substring_values(field, query)
+            postings = self._postings[field]
+            ids = set()
+            for value in values:
+                ids.update(postings[value])
+            return ids
+
+    # Typo-tolerant search: rank books by how many of the query's trigrams their
+    # field values share, using the trigram index to find candidates.
+    # Returns up to limit (book_id, score) pairs, best first.
+    def fuzzy_search(self, query, fields=("title", "author"), limit=20, threshold=FUZZY_THRESHOLD):
+        query = normalize(query)
+        query_grams = ngrams(query)
+        if not query_grams:
+            # Shorter than a trigram, nothing to be fuzzy about
+            ids = set()
+            for field in fields:
+                ids |= self.search(query, field)
+            return [(book_id, 1.0) for book_id in sorted(ids)[:limit]]
+
+        scores = {}
+        with self._lock:
+            for field in fields:
+                shared = {}
+                grams = self._grams[field]
+                for gram in query_grams:
+                    for value in grams.get(gram, ()):
+                        shared[value] = shared.get(value, 0) + 1
+
+                postings = self._postings[field]
+                for value, count in shared.items():
+                    # Containment first, Jaccard breaks ties in favour of closer lengths
+                    containment = count / len(query_grams)
+                    if containment < threshold:
+                        continue
+                    jaccard = count / (len(query_grams) + len(ngrams(value)) - count)
+                    score = (containment, jaccard)
+                    for book_id in postings[value]:
+                        if score > scores.get(book_id, (0, 0)):
+                            scores[book_id] = score
+
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
+        return [(book_id, round(score[0], 3)) for book_id, score in best]
+
+    def _substring_values(self, field, query):
+        postings = self._postings[field]
+        if len(query) < GRAM_SIZE:
+            # Too short for a trigram lookup, scan the distinct values instead of the books
+            return [value for value in postings if query in value]
+
+        grams = self._grams[field]
+        candidate_sets = []
+        for gram in ngrams(query):
+            values = grams.get(gram)
+            if not values:
+                return []
+            candidate_sets.append(values)
+        candidate_sets.sort(key=len)
+        candidates = set(candidate_sets[0]).intersection(*candidate_sets[1:])
+        return [value for value in candidates if query in value]
+
+    def _prefix_values(self, field, query):
+        words = tokenize(query)
+        if not words:
+            return []
+        result = None
+        for word in words:
+            values = set()
+            sorted_tokens = self._sorted_tokens[field]
+            position = bisect.bisect_left(sorted_tokens, word)
+            while position < len(sorted_tokens) and sorted_tokens[position].startswith(word):
+                values.update(self._tokens[field][sorted_tokens[position]])
+                position += 1
+            result = values if result is None else result & values
+            if not result:
+                return []
+        return result
+
+    def _add(self, book):
+        book_id = book["id"]
+        if book_id in self._docs:
+            self._remove(book_id)
+        values = tuple(normalize(book.get(field, "")) for field in SEARCH_FIELDS)
+        self._docs[book_id] = values
+        for field, value in zip(SEARCH_FIELDS, values):
+            postings = self._postings[field]
+            if value not in postings:
+                postings[value] = set()
+                self._index_value(field, value)
+            postings[value].add(book_id)
+
+    def _remove(self, book_id):
+        values = self._docs.pop(book_id, None)
+        if values is None:
+            return
+        for field, value in zip(SEARCH_FIELDS, values):
+            postings = self._postings[field]
+            postings[value].discard(book_id)
+            if not postings[value]:
+                del postings[value]
+                self._unindex_value(field, value)
+
+    def _index_value(self, field, value):
+        grams = self._grams[field]
+        for gram in ngrams(value):
+            grams.setdefault(gram, set()).add(value)
+        tokens = self._tokens[field]
+        for token in set(tokenize(value)):
+            if token not in tokens:
+                tokens[token] = set()
+                bisect.insort(self._sorted_tokens[field], token)
+            tokens[token].add(value)
+
+    def _unindex_value(self, field, value):
+        grams = self._grams[field]
+        for gram in ngrams(value):
+            grams[gram].discard(value)
+            if not grams[gram]:
+                del grams[gram]
+        tokens = self._tokens[field]
+        for token in set(tokenize(value)):
+            tokens[token].discard(value)
+            if not tokens[token]:
+                del tokens[token]
+                sorted_tokens = self._sorted_tokens[field]
+                del sorted_tokens[bisect.bisect_left(sorted_tokens, token)]
+
+    # Write the index to disk, tagged with the library generation it reflects
+    def save(self, path):
+        with self._save_lock:
+            with self._lock:
+                payload = pickle.dumps({
+                    "format": INDEX_FORMAT,
+                    "generation": self.generation,
+                    "docs": self._docs,
+                    "postings": self._postings,
+                    "grams": self._grams,
+                    "tokens": self._tokens,
+                    "sorted_tokens": self._sorted_tokens,
+                }, protocol=pickle.HIGHEST_PROTOCOL)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as file:
+                file.write(payload)
+            os.replace(tmp_path, path)
+
+    # Note a change and save it later: pickling the whole index on every write would
+    # cost O(library size) per write and hold up searches while it runs
+    def save_later(self, path, delay=SAVE_DELAY, every=SAVE_EVERY):
+        with self._pending_lock:
+            self._unsaved += 1
+            if self._unsaved >= every:
+                threading.Thread(target=self.save_pending, args=(path,), daemon=True).start()
+            elif self._save_timer is None:
+                self._save_timer = threading.Timer(delay, self.save_pending, args=(path,))
+                self._save_timer.daemon = True
+                self._save_timer.start()
+
+    # Save now if any change is waiting, e.g. at shutdown
+    def save_pending(self, path):
+        with self._pending_lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            if not self._unsaved:
+                return
+            self._unsaved = 0
+        self.save(path)
+
+    # Load the snapshot at path if it matches the generation, returns True on success
+    def load(self, path, generation):
+        try:
+            with open(path, "rb") as file:
+                state = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return False
+        if state.get("format") != INDEX_FORMAT or state.get("generation") != generation:
+            return False
+        with self._lock:
+            self._docs = state["docs"]
+            self._postings = state["postings"]
+            self._grams = state["grams"]
+            self._tokens = state["tokens"]
+            self._sorted_tokens = state["sorted_tokens"]
+            self.generation = generation
+        return True
+
+    # Bring the index up to date with the library, from the snapshot if possible
+    def load_or_rebuild(self, path, books, generation):
+        if not self.load(path, generation):
+            self.rebuild(books, generation)
+            self.save(path)
@@ -0,0 +1,262 @@
+import os
+import threading
+from contextlib import contextmanager
+
+from catalog import Catalog, ConflictError
+from cover_store import CoverRefs
+from facet_index import FacetIndex
+from library_stats import LibraryStats
+from search_index import SearchIndex
+from sorted_views import SortedViews
+
+
+# Many readers or one writer at a time; a waiting writer holds back new readers.
+# Not reentrant, so never take it twice on the same thread.
+class ReadWriteLock:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read_locked(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write_locked(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+# One in-memory copy of the library for the whole process, shared by every session.
+# It is reloaded only when the storage generation moves without us (another process
+# wrote), so the parse cost is paid once per change instead of once per rerun.
+# The search index, sorted views, facets and statistics hang off it and follow every write.
+# Given a CoverStore, covers that no book uses any more are deleted as they are released.
+# A cover stored before the write that uses it may be deleted in between, by a write that
+# released its last user, so writes take covers as (path, restore) and call restore()
+# for a file that is gone.
+#
+# Edits are optimistic: update() and remove() take the version of the book the caller
+# last saw and raise ConflictError if someone changed it since, instead of overwriting.
+# Every write holds the storage lock for just the write itself and first catches up with
+# other processes, so the check also holds across processes.
+class SharedLibrary:
+    def __init__(self, storage, search_index_path=None, cover_store=None):
+        self.storage = storage
+        self.search_index_path = search_index_path
+        self.cover_store = cover_store
+        self.catalog = Catalog()
+        self.generation = None
+        self._loaded = False
+        self._lock = ReadWriteLock()
+        self._index_lock = threading.Lock()
+        self._search_index = SearchIndex()
+        self._sorted_views = SortedViews()
+        self._stats = LibraryStats()
+        self._facets = FacetIndex()
+        self._cover_refs = CoverRefs()
+
+    # Hold a consistent view of the catalog, nothing can write while it is held
+    @contextmanager
+    def read(self):
+        self._refresh()
+        with self._lock.read_locked():
+            yield self.catalog
+
+    # Copy of the book with this id, or None
+    def get(self, book_id):
+        with self.read() as catalog:
+            book = catalog.get(book_id)
+            return dict(book) if book else None
+
+    # Copies of the books with these ids, skipping any that no longer exist
+    def get_many(self, book_ids):
+        with self.read() as catalog:
+            return [dict(catalog.get(book_id)) for book_id in book_ids if book_id in catalog]
+
+    # Search index for the current catalog, only call it inside read()
+    def search_index(self):
+        return self._ensure_index(self._search_index, self._rebuild)
+
+    # Sorted orderings for the current catalog, only call it inside read()
+    def sorted_views(self):
+        return self._ensure_index(self._sorted_views, self._rebuild)
+
+    # Genre, year and read-status bitmaps for the current catalog, only call it inside read()
+    def facets(self):
+        return self._ensure_index(self._facets, self._rebuild)
+
+    # Running statistics for the current catalog, only call it inside read()
+    def stats(self):
+        return self._ensure_index(self._stats, self._rebuild)
+
+    # Build the named index ("search_index", "sorted_views", "facets" or "stats") without
+    # holding the lock while it runs, so writes and page loads carry on meanwhile.
+    # A new index is built from the records of the moment and swapped in only if no write
+    # changed them in between. Returns False if one did and the index is still stale.
+    def build(self, name):
+        with self.read() as catalog:
+            if getattr(self, f"_{name}").generation == self.generation:
+                return True
+            start = (catalog, catalog.version, self.generation)
+            index = type(getattr(self, f"_{name}"))()
+            books = catalog.books
+        # Records edited during the build move catalog.version, and a reload replaces the catalog
+        self._rebuild(index, books, start[2])
+        with self.read() as catalog:
+            if (catalog, catalog.version, self.generation) != start:
+                return False
+            with self._index_lock:
+                if getattr(self, f"_{name}").generation != self.generation:
+                    setattr(self, f"_{name}", index)
+        return True
+
+    # Whether the catalog and the named indexes (all four by default) are current,
+    # without loading or building anything
+    def ready(self, *names):
+        names = names or ("search_index", "sorted_views", "facets", "stats")
+        if not self._loaded or self.storage.generation() != self.generation:
+            return False
+        return all(getattr(self, f"_{name}").generation == self.generation for name in names)
+
+    # Add a book and return the stored record, with its id and version
+    def add(self, book, covers=()):
+        def mutate(catalog):
+            record = catalog.add(book)
+            self.storage.add_book(catalog, record)
+            return record
+        return self._write(mutate, lambda index, record: index.add(record), covers=covers)
+
+    # Add many books with a single storage write. The indexes are rebuilt on
+    # next use, which is cheaper than one incremental update per book.
+    def add_many(self, books, covers=()):
+        def mutate(catalog):
+            records = [catalog.add(book) for book in books]
+            self.storage.add_books(catalog, records)
+            return records
+        return self._write(mutate, None, covers=covers)
+
+    # Apply changes to the book with this id and return the updated book.
+    # Given expected_version, raises ConflictError unless the book is still at that version.
+    def update(self, book_id, changes, expected_version=None, covers=()):
+        released = []
+
+        def mutate(catalog):
+            released.append(catalog.check(book_id, expected_version).get("image", ""))
+            book = catalog.update(book_id, changes)
+            self.storage.update_book(catalog, book)
+            return book
+        return self._write(mutate, lambda index, book: index.update(book), released, covers)
+
+    # Remove the book with this id and return it, ConflictError as for update()
+    def remove(self, book_id, expected_version=None):
+        released = []
+
+        def mutate(catalog):
+            book = catalog.remove(book_id, expected_version)
+            self.storage.remove_books(catalog, [book])
+            released.append(book.get("image", ""))
+            return book
+        return self._write(mutate, lambda index, book: index.remove(book_id), released)
+
+    # Write out index changes that are still waiting to be saved
+    def close(self):
+        if self.search_index_path:
+            self._search_index.save_pending(self.search_index_path)
+
+    def _refresh(self):
+        if self._loaded and self.storage.generation() == self.generation:
+            return
+        with self._lock.write_locked():
+            self._catch_up()
+
+    # Reload the catalog if the storage moved without us, only call it under the write lock
+    def _catch_up(self):
+        if self._loaded and self.storage.generation() == self.generation:
+            return
+        # Generation first: a write landing during the load then only makes us reload again
+        generation = self.storage.generation()
+        books = self.storage.load()
+        self.catalog = Catalog(books, self.storage.last_id())
+        self.generation = generation
+        self._loaded = True
+
+    # Fill an index from books, for the search index from its saved copy when that matches
+    def _rebuild(self, index, books=None, generation=None):
+        if books is None:
+            books, generation = self.catalog, self.generation
+        if isinstance(index, SearchIndex) and self.search_index_path:
+            index.load_or_rebuild(self.search_index_path, books, generation)
+        else:
+            index.rebuild(books, generation)
+
+    def _ensure_index(self, index, build):
+        if index.generation != self.generation:
+            with self._index_lock:
+                if index.generation != self.generation:
+                    build(index)
+        return index
+
+    # Delete released covers of the store that no book references any more.
+    # Runs under the write and storage locks, so no write can start using the cover
+    # meanwhile; one that stored it earlier puts it back with its restore().
+    def _collect_covers(self, released):
+        released = [image for image in released if self.cover_store and self.cover_store.owns(image)]
+        if not released:
+            return
+        refs = self._ensure_index(self._cover_refs, lambda refs: refs.rebuild(self.catalog, self.generation))
+        for image in released:
+            if not refs.count(image):
+                self.cover_store.delete(image)
+
+    def _write(self, mutate, change_index, released=(), covers=()):
+        with self._lock.write_locked(), self.storage.locked():
+            # No other process can write until we are done, so what we check is what we change
+            self._catch_up()
+            for image, restore in covers:
+                if not os.path.exists(image):
+                    restore()
+            generation_before = self.generation
+            try:
+                result = mutate(self.catalog)
+            except ConflictError:
+                # Raised before anything was changed
+                raise
+            except Exception:
+                # Memory and storage may disagree now, reload on next access
+                self._loaded = False
+                raise
+            self.generation = self.storage.generation()
+
+            # Indexes that were current follow the change, stale ones rebuild on next use.
+            # They get the stored record, with the defaults filled in, not the caller's dict.
+            for index in (self._search_index, self._sorted_views, self._facets, self._stats, self._cover_refs):
+                if change_index and index.generation == generation_before:
+                    change_index(index, result)
+                    index.generation = self.generation
+            if self.search_index_path and self._search_index.generation == self.generation:
+                self._search_index.save_later(self.search_index_path)
+            self._collect_covers(released)
+            return result
@@ -0,0 +1,127 @@
+import argparse
+import itertools
+import json
+import os
+from operator import itemgetter
+
+from catalog import BOOK_DEFAULTS, BOOK_KEYS, assign_missing_ids
+
+
+# Formats of a journal snapshot. "json" needs nothing extra and can be read by hand,
+# "arrow" is an Arrow IPC file (needs pyarrow), about a quarter of the size, written
+# several times faster and memory-mapped when loaded.
+SNAPSHOT_FORMATS = ["json", "arrow"]
+# Arrow IPC files start with these bytes, so read_snapshot() needn't be told the format
+ARROW_MAGIC = b"ARROW1"
+
+
+# Write the books, the generation (last change they contain) and the highest id ever
+# given out to a temporary file, fsync it and rename it over path
+def write_snapshot(path, generation, books, fmt="json", last_id=0):
+    if fmt not in SNAPSHOT_FORMATS:
+        raise ValueError(f"Unknown snapshot format: {fmt}")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if fmt == "arrow":
+        with open(tmp_path, "wb") as file:
+            _write_arrow(file, generation, books, last_id)
+            file.flush()
+            os.fsync(file.fileno())
+    else:
+        # One dumps() is several times faster than dump(), which encodes in small pieces
+        text = json.dumps({"generation": generation, "last_id": last_id, "books": books}, separators=(",", ":"))
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            file.write(text)
+            file.flush()
+            os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+# Read a snapshot in any format as (generation, books, last_id). A plain library.json
+# counts as generation 0. Raises FileNotFoundError if there is none.
+def read_snapshot(path):
+    with open(path, "rb") as file:
+        if file.read(len(ARROW_MAGIC)) != ARROW_MAGIC:
+            file.seek(0)
+            snapshot = json.load(file)
+            if isinstance(snapshot, list):
+                return 0, snapshot, 0
+            return snapshot["generation"], snapshot["books"], snapshot.get("last_id", 0)
+    return _read_arrow(path)
+
+
+# One column per book field; authors, genres and cover paths repeat, so they are
+# dictionary-encoded and every distinct value is stored once
+def _arrow_schema(pa, generation, last_id):
+    text = pa.dictionary(pa.int32(), pa.string())
+    types = {"id": pa.int64(), "title": pa.string(), "author": text, "year": pa.int64(), "genre": text,
+             "read": pa.bool_(), "image": text, "version": pa.int64()}
+    return pa.schema([(key, types[key]) for key in BOOK_KEYS],
+                     metadata={"generation": str(generation), "last_id": str(last_id)})
+
+
+def _write_arrow(file, generation, books, last_id):
+    import pyarrow as pa
+
+    schema = _arrow_schema(pa, generation, last_id)
+    columns = []
+    for field in schema:
+        try:
+            values = list(map(itemgetter(field.name), books))
+        except KeyError:
+            # Books from an old library.json may lack fields added since
+            default = BOOK_DEFAULTS.get(field.name)
+            values = [book.get(field.name, default) for book in books]
+        if field.name == "year":
+            values = [int(year) for year in values]
+        columns.append(pa.array(values, field.type))
+    with pa.ipc.new_file(file, schema) as writer:
+        writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+
+
+# Memory-map the file and turn the columns back into book dicts. Columns are converted
+# whole, which is far cheaper than going row by row, and the dictionary-encoded ones give
+# every book the same string object for the same author or genre.
+def _read_arrow(path):
+    import pyarrow as pa
+
+    with pa.memory_map(path) as source:
+        table = pa.ipc.open_file(source).read_all()
+        generation = int(table.schema.metadata[b"generation"])
+        last_id = int(table.schema.metadata.get(b"last_id", 0))
+        names = table.column_names
+        columns = [_column_values(pa, table.column(name)) for name in names]
+    books = list(map(dict, map(zip, itertools.repeat(names), zip(*columns))))
+    return generation, books, last_id
+
+
+def _column_values(pa, column):
+    values = []
+    for chunk in column.chunks:
+        if pa.types.is_dictionary(chunk.type):
+            words = chunk.dictionary.to_pylist()
+            values.extend([words[index] for index in chunk.indices.to_numpy().tolist()])
+        elif pa.types.is_string(chunk.type):
+            values.extend(chunk.to_pylist())
+        else:
+            values.extend(chunk.to_numpy(zero_copy_only=False).tolist())
+    return values
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert a library.json or a journal snapshot to another format.")
+    parser.add_argument("source", help="library.json or snapshot to read")
+    parser.add_argument("target", help="snapshot to write")
+    parser.add_argument("--format", choices=SNAPSHOT_FORMATS, help="defaults to arrow for a .arrow target, else json")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("arrow" if args.target.endswith(".arrow") else "json")
+    generation, books, last_id = read_snapshot(args.source)
+    assign_missing_ids(books)
+    # A plain library.json has no last_id, the highest id in it is the best there is
+    last_id = max([last_id] + [book["id"] for book in books])
+    write_snapshot(args.target, generation, books, fmt, last_id)
+    print(f"Wrote {len(books)} books to {args.target} as {fmt}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import bisect
+import threading
+
+from facet_index import bitmap_ids
+
+
+# Orderings offered by the "Sort Books By" dropdown
+SORT_FIELDS = ("title", "author", "year")
+
+# Filtered orderings kept between reruns, dropped on any change
+MAX_SELECTIONS = 8
+
+
+# Sort key for a book under one ordering; title and id make every key unique
+# so books with equal values keep a stable order between reruns
+def sort_key(book, field):
+    return (book[field], book["title"], book["id"])
+
+
+# Persistent sorted orderings of the library by title, author and year.
+# Changes are applied with bisect insertion instead of re-sorting, and a page
+# of the ordering is a plain list slice.
+class SortedViews:
+    def __init__(self):
+        self.generation = None
+        self._lock = threading.RLock()
+        self._keys = {field: [] for field in SORT_FIELDS}
+        self._book_keys = {}
+        self._selections = {}
+
+    def __len__(self):
+        return len(self._book_keys)
+
+    # Replace the orderings with the given books
+    def rebuild(self, books, generation=None):
+        with self._lock:
+            self._book_keys = {book["id"]: {field: sort_key(book, field) for field in SORT_FIELDS} for book in books}
+            for field in SORT_FIELDS:
+                self._keys[field] = sorted(keys[field] for keys in self._book_keys.values())
+            self._selections = {}
+            self.generation = generation
+
+    def add(self, book):
+        with self._lock:
+            self._add(book)
+
+    def update(self, book):
+        with self._lock:
+            self._remove(book["id"])
+            self._add(book)
+
+    def remove(self, book_id):
+        with self._lock:
+            self._remove(book_id)
+
+    # Ids of the books at positions start..start+count in the given ordering
+    def page(self, field, start, count):
+        with self._lock:
+            return [key[-1] for key in self._keys[field][start:start + count]]
+
+    # Ids of the books in a FacetIndex bitmap, in the given ordering.
+    # One pass over the ordering, then cached so paging through it is a slice.
+    def select(self, field, mask):
+        with self._lock:
+            selection = self._selections.get((field, mask))
+            if selection is None:
+                members = set(bitmap_ids(mask))
+                selection = [key[-1] for key in self._keys[field] if key[-1] in members]
+                if len(self._selections) >= MAX_SELECTIONS:
+                    self._selections.pop(next(iter(self._selections)))
+                self._selections[(field, mask)] = selection
+            return selection
+
+    def _add(self, book):
+        self._selections = {}
+        if book["id"] in self._book_keys:
+            self._remove(book["id"])
+        keys = {field: sort_key(book, field) for field in SORT_FIELDS}
+        self._book_keys[book["id"]] = keys
+        for field in SORT_FIELDS:
+            bisect.insort(self._keys[field], keys[field])
+
+    def _remove(self, book_id):
+        self._selections = {}
+        keys = self._book_keys.pop(book_id, None)
+        if keys is None:
+            return
+        for field in SORT_FIELDS:
+            ordering = self._keys[field]
+            del ordering[bisect.bisect_left(ordering, keys[field])]
@@ -0,0 +1,748 @@
+import json
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from operator import itemgetter
+
+from catalog import assign_missing_ids
+from snapshot import read_snapshot, write_snapshot
+
+try:
+    import fcntl
+except ImportError:
+    # No cross-process file locks on Windows, the journal then assumes one writing process
+    fcntl = None
+
+
+# Fields stored for every book, in display order
+BOOK_FIELDS = ["title", "author", "year", "genre", "read", "image", "version"]
+
+
+# Original storage: the whole library as one pretty-printed JSON file.
+# Every mutation rewrites the file. The highest id ever stored is kept next to it,
+# in <path>.last_id, so the file itself keeps its original layout.
+class JsonStorage:
+    def __init__(self, path):
+        self.path = path
+        self.last_id_path = path + ".last_id"
+        self._lock = _FileLock(threading.RLock(), path + ".lock")
+
+    # Load the library, giving ids to books saved before ids existed
+    def load(self):
+        library = self.read()
+        if assign_missing_ids(library):
+            self.save(library)
+        return library
+
+    # Read the file as-is, without touching it
+    def read(self):
+        if os.path.exists(self.path):
+            with open(self.path, "r") as file:
+                return json.load(file)
+        return []
+
+    # Written to a temporary file and renamed over the old one, so readers never see half a file
+    def save(self, library):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with self._lock:
+            self._raise_last_id(library)
+            with open(tmp_path, "w") as file:
+                json.dump([dict(book) for book in library], file, indent=4)
+            os.replace(tmp_path, self.path)
+
+    # Keeps other threads and processes from writing while held, for the length of one write
+    def locked(self):
+        return self._lock
+
+    # Highest id ever stored, removed books included
+    def last_id(self):
+        try:
+            with open(self.last_id_path, "r") as file:
+                return int(file.read())
+        except (OSError, ValueError):
+            return 0
+
+    # Written before the books, so the mark is never below an id on disk
+    def _raise_last_id(self, books):
+        last_id = max((book["id"] for book in books if book.get("id") is not None), default=0)
+        if last_id > self.last_id():
+            _write_json(self.last_id_path, last_id)
+
+    # Changes whenever the file is rewritten
+    def generation(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def add_book(self, library, book):
+        self.save(library)
+
+    def add_books(self, library, books):
+        self.save(library)
+
+    def update_book(self, library, book):
+        self.save(library)
+
+    def remove_books(self, library, books):
+        self.save(library)
+
+
+# SQLite storage: one row per book, so adds, edits and removes only touch their own rows.
+# WAL mode lets several Streamlit sessions read while another one writes.
+class SqliteStorage:
+    def __init__(self, path, json_path=None):
+        self.path = path
+        self._local = threading.local()
+        self._lock = _FileLock(threading.RLock(), path + ".lock")
+        self._create_schema()
+        if json_path:
+            self.migrate_from_json(json_path)
+
+    # One connection per thread, Streamlit runs every session on its own thread
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _create_schema(self):
+        conn = self._connect()
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS books (
+                    id INTEGER PRIMARY KEY,
+                    title TEXT NOT NULL,
+                    author TEXT NOT NULL,
+                    year INTEGER NOT NULL,
+                    genre TEXT NOT NULL DEFAULT '',
+                    read INTEGER NOT NULL DEFAULT 0,
+                    image TEXT NOT NULL DEFAULT '',
+                    version INTEGER NOT NULL DEFAULT 1
+                )
+            """)
+            # Databases made before books had versions
+            if "version" not in {row["name"] for row in conn.execute("PRAGMA table_info(books)")}:
+                conn.execute("ALTER TABLE books ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+            for field in ["title", "author", "year", "genre", "read"]:
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_books_{field} ON books ({field})")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0)")
+            # Highest id ever stored; rows alone can't tell once the newest book is removed
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) SELECT 'last_id', COALESCE(MAX(id), 0) FROM books")
+
+    # One-shot import of an existing library.json, tracked with PRAGMA user_version
+    def migrate_from_json(self, json_path):
+        conn = self._connect()
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= 1:
+            return
+        with conn:
+            if os.path.exists(json_path):
+                json_storage = JsonStorage(json_path)
+                books = json_storage.read()
+                for book in books:
+                    self._insert(conn, book)
+                self._raise_last_id(conn, books, json_storage.last_id())
+            self._bump_generation(conn)
+            conn.execute("PRAGMA user_version = 1")
+
+    def load(self):
+        rows = self._connect().execute("SELECT * FROM books ORDER BY id")
+        return [_row_to_book(row) for row in rows]
+
+    # Replace the whole table, only used for migrations and bulk rewrites
+    def save(self, library):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM books")
+            for book in library:
+                self._insert(conn, book)
+            self._raise_last_id(conn, library)
+            self._bump_generation(conn)
+
+    def add_book(self, library, book):
+        conn = self._connect()
+        with conn:
+            self._insert(conn, book)
+            self._raise_last_id(conn, [book])
+            self._bump_generation(conn)
+
+    # Insert many books in a single transaction
+    def add_books(self, library, books):
+        conn = self._connect()
+        with conn:
+            for book in books:
+                self._insert(conn, book)
+            self._raise_last_id(conn, books)
+            self._bump_generation(conn)
+
+    def update_book(self, library, book):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "UPDATE books SET title = ?, author = ?, year = ?, genre = ?, read = ?, image = ?, version = ? "
+                "WHERE id = ?",
+                [*_book_values(book), book["id"]]
+            )
+            self._bump_generation(conn)
+
+    def remove_books(self, library, books):
+        conn = self._connect()
+        with conn:
+            conn.executemany("DELETE FROM books WHERE id = ?", [(book["id"],) for book in books])
+            self._bump_generation(conn)
+
+    # Write counter, bumped in the same transaction as every change
+    def generation(self):
+        return self._connect().execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+
+    # Highest id ever stored, removed books included
+    def last_id(self):
+        return self._connect().execute("SELECT value FROM meta WHERE key = 'last_id'").fetchone()[0]
+
+    # SQLite serialises the transactions themselves; this keeps other writers out between
+    # reading the generation and committing, so nothing is written on top of a stale catalog
+    def locked(self):
+        return self._lock
+
+    def _bump_generation(self, conn):
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+
+    def _raise_last_id(self, conn, books, last_id=0):
+        last_id = max([last_id] + [book["id"] for book in books])
+        conn.execute("UPDATE meta SET value = MAX(value, ?) WHERE key = 'last_id'", [last_id])
+
+    def _insert(self, conn, book):
+        cursor = conn.execute(
+            "INSERT INTO books (id, title, author, year, genre, read, image, version) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [book.get("id"), *_book_values(book)]
+        )
+        book["id"] = cursor.lastrowid
+
+
+# Journal defaults: fsync at most every SYNC_INTERVAL seconds or SYNC_EVERY writes,
+# and fold the log into a new snapshot once it holds COMPACT_AFTER records
+SYNC_INTERVAL = 0.2
+SYNC_EVERY = 64
+COMPACT_AFTER = 1000
+
+
+# Journaled storage: a snapshot of the whole library plus an append-only log of changes.
+# A write appends one compact JSON line, so it costs the same whatever the library size.
+# Loading reads the snapshot and replays the log; every record has a sequence number and
+# the snapshot remembers the last one it contains, so replaying never applies a change twice.
+# Once the log is long enough it is moved aside and folded into a new snapshot in the
+# background, the snapshot being swapped in with an atomic rename.
+#
+# The snapshot is JSON, or with snapshot_format="arrow" a memory-mapped Arrow file,
+# see snapshot.py; the "arrow" backend is the journal with an Arrow snapshot.
+#
+# Records are flushed to the OS at once and fsynced in batches, so a process crash loses
+# nothing and a power loss at most the last sync_interval seconds of writes. A torn last
+# line is ignored on load and cut off before the next append.
+class JournalStorage:
+    def __init__(self, snapshot_path, log_path, json_path=None, sync_interval=SYNC_INTERVAL,
+                 sync_every=SYNC_EVERY, compact_after=COMPACT_AFTER, snapshot_format="json"):
+        self.snapshot_path = snapshot_path
+        self.snapshot_format = snapshot_format
+        self.log_path = log_path
+        self.old_log_path = log_path + ".old"
+        self.sync_interval = sync_interval
+        self.sync_every = sync_every
+        self.compact_after = compact_after
+        self._lock = threading.RLock()
+        self._log_lock = _FileLock(self._lock, log_path + ".lock")
+        self._snapshot_lock = _FileLock(threading.RLock(), snapshot_path + ".lock")
+        self._file = None
+        self._unsynced = 0
+        self._sync_timer = None
+        self._compaction = None
+        # Highest id ever stored, as of the last load()
+        self._last_id = None
+        # (inode, size, base, record count) of the log, so generation() is usually one stat
+        self._log_state = None
+        if json_path and not os.path.exists(snapshot_path) and not os.path.exists(log_path):
+            self._migrate_from_json(json_path)
+
+    def load(self):
+        # Logs first, then the snapshot: a compaction finishing in between only makes
+        # the snapshot newer, and records it already contains are skipped
+        with self._log_lock:
+            records = self._read_log(self.old_log_path)[2] + self._read_log(self.log_path)[2]
+        generation, books, last_id = self._read_snapshot()
+        by_id = {book["id"]: book for book in books}
+        for sequence, record in records:
+            if sequence > generation:
+                _apply_record(by_id, record)
+        self._last_id = max(last_id, _records_last_id(records))
+        return list(by_id.values())
+
+    # Replace the whole library, only used for migrations and bulk rewrites
+    def save(self, library):
+        with self._snapshot_lock, self._log_lock:
+            generation = self.generation() + 1
+            # The snapshot claims every record so far, so older logs are ignored
+            # even if a crash leaves them behind
+            last_id = max([self.last_id()] + [book["id"] for book in library])
+            self._write_snapshot(generation, [dict(book) for book in library], last_id)
+            self._last_id = last_id
+            self._start_log(generation)
+            _remove(self.old_log_path)
+
+    def add_book(self, library, book):
+        self._append({"op": "put", "books": [dict(book)]})
+
+    def add_books(self, library, books):
+        self._append({"op": "put", "books": [dict(book) for book in books]})
+
+    def update_book(self, library, book):
+        self._append({"op": "put", "books": [dict(book)]})
+
+    def remove_books(self, library, books):
+        self._append({"op": "remove", "ids": [book["id"] for book in books]})
+
+    # Number of changes ever written, moves whenever any process appends.
+    # Only the bytes appended since the last call are read.
+    def generation(self):
+        try:
+            stat = os.stat(self.log_path)
+        except OSError:
+            return 0
+        state = self._log_state
+        if state is None or state[0] != stat.st_ino or state[1] > stat.st_size:
+            base, count = self._scan_log()
+            state = (stat.st_ino, stat.st_size, base, count)
+        elif state[1] < stat.st_size:
+            with open(self.log_path, "rb") as file:
+                file.seek(state[1])
+                added = file.read(stat.st_size - state[1])
+            state = (stat.st_ino, stat.st_size, state[2], state[3] + added.count(b"\n"))
+        self._log_state = state
+        return state[2] + state[3]
+
+    # The log lock, which every append takes anyway
+    def locked(self):
+        return self._log_lock
+
+    # Highest id ever stored, removed books included, as of the last load(). The snapshot
+    # keeps it, so compacting away the records of removed books doesn't lower it.
+    def last_id(self):
+        if self._last_id is None:
+            self.load()
+        return self._last_id
+
+    # fsync everything appended so far
+    def sync(self):
+        with self._lock:
+            if self._sync_timer is not None:
+                self._sync_timer.cancel()
+                self._sync_timer = None
+            if self._file is not None and self._unsynced:
+                os.fsync(self._file.fileno())
+            self._unsynced = 0
+
+    # Fold the log into a new snapshot, in a background thread unless wait is set
+    def compact(self, wait=False):
+        with self._lock:
+            thread = self._compaction
+            if thread is None or not thread.is_alive():
+                thread = self._compaction = threading.Thread(target=self._compact, daemon=True)
+                thread.start()
+        if wait:
+            thread.join()
+
+    # Flush pending writes and wait for a running compaction
+    def close(self):
+        if self._compaction is not None:
+            self._compaction.join()
+        with self._lock:
+            self.sync()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _append(self, record):
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+        with self._log_lock:
+            file = self._open_log()
+            file.write(line)
+            file.flush()
+            count = self.generation() - self._log_state[2]
+            self._unsynced += 1
+            if self._unsynced >= self.sync_every:
+                self.sync()
+            elif self._sync_timer is None:
+                self._sync_timer = threading.Timer(self.sync_interval, self.sync)
+                self._sync_timer.daemon = True
+                self._sync_timer.start()
+        if count >= self.compact_after:
+            self.compact()
+
+    # Append handle for the current log file, reopened if another process rotated it
+    def _open_log(self):
+        if not os.path.exists(self.log_path):
+            self._start_log(self.generation())
+        if self._file is None or os.fstat(self._file.fileno()).st_ino != os.stat(self.log_path).st_ino:
+            if self._file is not None:
+                self.sync()
+                self._file.close()
+            self._cut_torn_line()
+            self._file = open(self.log_path, "ab")
+        return self._file
+
+    # Drop a partial last line left by a crash mid-append
+    def _cut_torn_line(self):
+        with open(self.log_path, "r+b") as file:
+            size = file.seek(0, os.SEEK_END)
+            start = max(0, size - 64 * 1024)
+            file.seek(start)
+            tail = file.read()
+            if tail and not tail.endswith(b"\n"):
+                file.truncate(start + tail.rfind(b"\n") + 1)
+
+    # Swap in an empty log whose records continue from base. The log path always exists,
+    # a compaction links the current log as the old log before calling this.
+    def _start_log(self, base):
+        tmp_path = f"{self.log_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8", newline="\n") as file:
+            file.write(json.dumps({"base": base}) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        self.sync()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        os.replace(tmp_path, self.log_path)
+        self._log_state = None
+
+    def _compact(self):
+        with self._snapshot_lock.attempt() as locked:
+            if not locked:
+                # Another process is compacting
+                return
+            with self._log_lock:
+                if not os.path.exists(self.old_log_path):
+                    os.link(self.log_path, self.old_log_path)
+                    self._start_log(self.generation())
+            generation, books, last_id = self._read_snapshot()
+            by_id = {book["id"]: book for book in books}
+            base, count, records = self._read_log(self.old_log_path)
+            for sequence, record in records:
+                if sequence > generation:
+                    _apply_record(by_id, record)
+            last_id = max(last_id, _records_last_id(records))
+            self._write_snapshot(max(generation, base + count), list(by_id.values()), last_id)
+            _remove(self.old_log_path)
+
+    def _read_snapshot(self):
+        try:
+            return read_snapshot(self.snapshot_path)
+        except FileNotFoundError:
+            return 0, [], 0
+
+    def _write_snapshot(self, generation, books, last_id):
+        write_snapshot(self.snapshot_path, generation, books, self.snapshot_format, last_id)
+
+    # Base and number of complete records of the current log, without parsing them
+    def _scan_log(self):
+        try:
+            with open(self.log_path, "rb") as file:
+                header = file.readline()
+                count = sum(chunk.count(b"\n") for chunk in iter(lambda: file.read(1024 * 1024), b""))
+        except FileNotFoundError:
+            return 0, 0
+        if not header.endswith(b"\n"):
+            return 0, 0
+        return json.loads(header)["base"], count
+
+    # Read a log file as (base, record count, [(sequence, record), ...]).
+    # Stops at the first incomplete or unreadable line.
+    def _read_log(self, path):
+        try:
+            with open(path, "r", encoding="utf-8", newline="\n") as file:
+                lines = file.read().split("\n")
+        except FileNotFoundError:
+            return 0, 0, []
+        # The text after the last newline is either empty or a torn write
+        lines.pop()
+        if not lines:
+            return 0, 0, []
+        base = json.loads(lines[0])["base"]
+        records = []
+        for line in lines[1:]:
+            try:
+                records.append((base + len(records) + 1, json.loads(line)))
+            except json.JSONDecodeError:
+                break
+        return base, len(records), records
+
+    def _migrate_from_json(self, json_path):
+        json_storage = JsonStorage(json_path)
+        library = json_storage.load()
+        last_id = max([json_storage.last_id()] + [book["id"] for book in library])
+        with self._snapshot_lock, self._log_lock:
+            if not os.path.exists(self.log_path):
+                self._write_snapshot(0, library, last_id)
+                self._start_log(0)
+
+
+# Shards of a new sharded library, an existing one keeps the count in its manifest
+SHARD_COUNT = 16
+
+
+# Sharded storage for very large libraries: the books are spread over shard files by id
+# (id % shard count, so a book never changes shard), next to a manifest.json holding the
+# shard count, the number of books in every shard, the highest id ever stored and a write
+# counter.
+# A write reads and rewrites only the shards its books live in, then the manifest, each
+# swapped in with an atomic rename. load() still reads every shard, on a thread pool, and
+# queries run on the in-memory indexes, so sharding speeds up writes and nothing else.
+class ShardedStorage:
+    def __init__(self, folder, json_path=None, shard_count=SHARD_COUNT, max_workers=None):
+        self.folder = folder
+        self.manifest_path = os.path.join(folder, "manifest.json")
+        self.max_workers = max_workers
+        self._lock = _FileLock(threading.RLock(), self.manifest_path + ".lock")
+        # Stat key and contents of the manifest last read, so generation() is usually one stat
+        self._manifest_state = None
+        os.makedirs(folder, exist_ok=True)
+        with self._lock:
+            if not os.path.exists(self.manifest_path):
+                self._create(shard_count, json_path)
+
+    @property
+    def shard_count(self):
+        return self._manifest()["shard_count"]
+
+    # Number of books, from the manifest alone
+    def count(self):
+        return sum(self._manifest()["counts"])
+
+    # Highest id ever stored, removed books included
+    def last_id(self):
+        return self._manifest().get("last_id", 0)
+
+    def load(self):
+        paths = [self._shard_path(shard) for shard in range(self.shard_count)]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            books = [book for shard in pool.map(_read_shard, paths) for book in shard]
+        books.sort(key=itemgetter("id"))
+        return books
+
+    # Rewrite every shard, only used for migrations and bulk rewrites
+    def save(self, library):
+        with self._lock:
+            manifest = self._manifest()
+            shards = [[] for shard in range(manifest["shard_count"])]
+            for book in library:
+                shards[book["id"] % manifest["shard_count"]].append(dict(book))
+            for shard, books in enumerate(shards):
+                _write_json(self._shard_path(shard), books)
+            last_id = max([manifest.get("last_id", 0)] + [book["id"] for book in library])
+            self._write_manifest(manifest, [len(books) for books in shards], last_id)
+
+    def add_book(self, library, book):
+        self._rewrite([book])
+
+    def add_books(self, library, books):
+        self._rewrite(books)
+
+    def update_book(self, library, book):
+        self._rewrite([book])
+
+    def remove_books(self, library, books):
+        self._rewrite(books, remove=True)
+
+    # Write counter from the manifest, moves whenever any process writes
+    def generation(self):
+        return self._manifest()["generation"]
+
+    # The manifest lock, which every write takes anyway
+    def locked(self):
+        return self._lock
+
+    # Read the shards of books, put or remove the books and write those shards back
+    def _rewrite(self, books, remove=False):
+        with self._lock:
+            manifest = self._manifest()
+            counts = list(manifest["counts"])
+            last_id = manifest.get("last_id", 0)
+            if not remove:
+                last_id = max([last_id] + [book["id"] for book in books])
+            groups = {}
+            for book in books:
+                groups.setdefault(book["id"] % manifest["shard_count"], []).append(book)
+            for shard, group in groups.items():
+                path = self._shard_path(shard)
+                # Dict order keeps edited books in place and appends new ones
+                by_id = {book["id"]: book for book in _read_shard(path)}
+                for book in group:
+                    if remove:
+                        by_id.pop(book["id"], None)
+                    else:
+                        by_id[book["id"]] = dict(book)
+                _write_json(path, list(by_id.values()))
+                counts[shard] = len(by_id)
+            self._write_manifest(manifest, counts, last_id)
+
+    # New empty shards, filled from an existing library.json
+    def _create(self, shard_count, json_path):
+        manifest = {"partition": "id", "shard_count": shard_count, "generation": 0, "counts": [0] * shard_count}
+        for shard in range(shard_count):
+            _write_json(self._shard_path(shard), [])
+        json_storage = JsonStorage(json_path) if json_path else None
+        self._write_manifest(manifest, manifest["counts"], json_storage.last_id() if json_storage else 0)
+        if json_storage and os.path.exists(json_path):
+            self.save(json_storage.load())
+
+    def _shard_path(self, shard):
+        return os.path.join(self.folder, f"shard-{shard:03d}.json")
+
+    def _manifest(self):
+        stat = os.stat(self.manifest_path)
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        state = self._manifest_state
+        if state is None or state[0] != key:
+            with open(self.manifest_path, "r", encoding="utf-8") as file:
+                state = self._manifest_state = (key, json.load(file))
+        return state[1]
+
+    # Written last, so the generation only moves once the shards are in place
+    def _write_manifest(self, manifest, counts, last_id):
+        manifest = dict(manifest, generation=manifest["generation"] + 1, counts=counts, last_id=last_id)
+        _write_json(self.manifest_path, manifest)
+        self._manifest_state = None
+
+
+# A reentrant threading lock plus, where fcntl exists, an exclusive lock on a lock file
+# that is taken by the outermost holder, so other processes are kept out too.
+class _FileLock:
+    def __init__(self, lock, path):
+        self.lock = lock
+        self.path = path
+        self._depth = 0
+        self._file = None
+
+    def __enter__(self):
+        self.lock.acquire()
+        self._lock_file(blocking=True)
+        return True
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if not self._depth and self._file is not None:
+            self._file.close()
+            self._file = None
+        self.lock.release()
+
+    # Take the lock only if nobody holds it, entering yields whether it was taken
+    @contextmanager
+    def attempt(self):
+        if not self.lock.acquire(blocking=False):
+            yield False
+            return
+        if not self._lock_file(blocking=False):
+            self.lock.release()
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            self.__exit__()
+
+    def _lock_file(self, blocking):
+        if not self._depth and fcntl is not None:
+            self._file = open(self.path, "a")
+            try:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self._file.close()
+                self._file = None
+                return False
+        self._depth += 1
+        return True
+
+
+# Apply one log record to a dict of books by id
+def _apply_record(by_id, record):
+    if record["op"] == "put":
+        for book in record["books"]:
+            by_id[book["id"]] = book
+    elif record["op"] == "remove":
+        for book_id in record["ids"]:
+            by_id.pop(book_id, None)
+
+
+# Books of one shard file, none if it is missing
+def _read_shard(path):
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return []
+
+
+# Write compact JSON to a temporary file and rename it over path
+def _write_json(path, data):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(data, file, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+# Highest book id named by (sequence, record) log pairs
+def _records_last_id(records):
+    last_id = 0
+    for sequence, record in records:
+        ids = [book["id"] for book in record["books"]] if record["op"] == "put" else record["ids"]
+        last_id = max([last_id] + ids)
+    return last_id
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _book_values(book):
+    return [book["title"], book["author"], int(book["year"]), book.get("genre", ""),
+            int(bool(book["read"])), book.get("image", ""), book.get("version", 1)]
+
+
+def _row_to_book(row):
+    book = {"id": row["id"]}
+    for field in BOOK_FIELDS:
+        book[field] = row[field]
+    book["read"] = bool(book["read"])
+    return book
+
+
+BACKENDS = ["sqlite", "json", "journal", "arrow", "sharded"]
+
+
+# Open the storage backend selected by name (one of BACKENDS)
+def open_storage(backend, data_folder):
+    json_path = os.path.join(data_folder, "library.json")
+    if backend == "json":
+        return JsonStorage(json_path)
+    if backend == "sqlite":
+        return SqliteStorage(os.path.join(data_folder, "library.db"), json_path=json_path)
+    if backend == "journal":
+        return JournalStorage(os.path.join(data_folder, "library.snapshot.json"),
+                              os.path.join(data_folder, "library.log"), json_path=json_path)
+    if backend == "arrow":
+        return JournalStorage(os.path.join(data_folder, "library.snapshot.arrow"),
+                              os.path.join(data_folder, "library.arrow.log"), json_path=json_path,
+                              snapshot_format="arrow")
+    if backend == "sharded":
+        return ShardedStorage(os.path.join(data_folder, "library.shards"), json_path=json_path)
+    raise ValueError(f"Unknown storage backend: {backend}")
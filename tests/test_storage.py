@@ -0,0 +1,151 @@
+import os
+import threading
+
+import pytest
+
+from catalog import ConflictError
+from shared_library import SharedLibrary
+from storage import BACKENDS, JournalStorage, open_storage
+
+
+def make_book(title, book_id=None):
+    book = {"title": title, "author": "Author", "year": 2000, "genre": "Fiction", "read": False, "image": ""}
+    if book_id is not None:
+        book["id"] = book_id
+    return book
+
+
+@pytest.fixture
+def open_backend(tmp_path):
+    opened = []
+
+    def open_backend(backend):
+        storage = open_storage(backend, str(tmp_path))
+        opened.append(storage)
+        return storage
+    yield open_backend
+    for storage in opened:
+        if hasattr(storage, "close"):
+            storage.close()
+
+
+@pytest.fixture
+def journal(tmp_path):
+    storages = []
+
+    def journal(**options):
+        storage = JournalStorage(str(tmp_path / "snapshot.json"), str(tmp_path / "library.log"), **options)
+        storages.append(storage)
+        return storage
+    yield journal
+    for storage in storages:
+        storage.close()
+
+
+def titles(books):
+    return sorted(book["title"] for book in books)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_writes_survive_a_reload(open_backend, backend):
+    library = SharedLibrary(open_backend(backend))
+    first = library.add(make_book("One"))
+    second = library.add(make_book("Two"))
+    library.update(first["id"], {"title": "One, edited"})
+    library.remove(second["id"])
+
+    books = open_backend(backend).load()
+    assert titles(books) == ["One, edited"]
+    assert books[0]["version"] == 2
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_stale_version_raises_conflict(open_backend, backend):
+    session_a = SharedLibrary(open_backend(backend))
+    session_b = SharedLibrary(open_backend(backend))
+    book = session_a.add(make_book("One"))
+    seen = session_b.get(book["id"])
+
+    session_a.update(book["id"], {"title": "Changed by A"}, seen["version"])
+    with pytest.raises(ConflictError) as error:
+        session_b.update(book["id"], {"title": "Changed by B"}, seen["version"])
+    assert error.value.book["title"] == "Changed by A"
+    with pytest.raises(ConflictError):
+        session_b.remove(book["id"], seen["version"])
+
+    # With the current version the edit goes through after B caught up
+    current = session_b.get(book["id"])
+    assert session_b.update(book["id"], {"title": "Changed by B"}, current["version"])["version"] == 3
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_removed_ids_are_not_reused(open_backend, backend):
+    session_a = SharedLibrary(open_backend(backend))
+    session_a.add(make_book("One"))
+    newest = session_a.add(make_book("Two"))
+    session_b = SharedLibrary(open_backend(backend))
+    seen = session_b.get(newest["id"])
+
+    session_a.remove(newest["id"])
+    storage = open_backend(backend)
+    if hasattr(storage, "compact"):
+        storage.compact(wait=True)
+    added = SharedLibrary(open_backend(backend)).add(make_book("Totally different"))
+
+    assert added["id"] > newest["id"]
+    with pytest.raises(ConflictError):
+        session_b.update(newest["id"], {"title": "Stale"}, seen["version"])
+    assert titles(open_backend(backend).load()) == ["One", "Totally different"]
+
+
+def test_journal_ignores_a_torn_last_line(journal, tmp_path):
+    storage = journal()
+    storage.add_book(None, make_book("One", 1))
+    storage.add_book(None, make_book("Two", 2))
+    storage.close()
+    # A crash in the middle of an append
+    with open(tmp_path / "library.log", "ab") as file:
+        file.write(b'{"op":"put","books":[{"id":3,"ti')
+
+    storage = journal()
+    assert titles(storage.load()) == ["One", "Two"]
+    assert storage.generation() == 2
+
+    # The torn line is cut off before the next append, which then replays normally
+    storage.add_book(None, make_book("Three", 3))
+    assert titles(journal().load()) == ["One", "Three", "Two"]
+
+
+def test_journal_compaction_keeps_concurrent_appends(journal):
+    storage = journal(compact_after=50)
+    threads = [
+        threading.Thread(target=lambda start=start: [
+            storage.add_book(None, make_book(f"Book {book_id}", book_id)) for book_id in range(start, start + 200)
+        ])
+        for start in (1, 1001, 2001)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    storage.compact(wait=True)
+
+    reader = journal()
+    assert len(reader.load()) == 600
+    assert reader.generation() == storage.generation() == 600
+
+
+def test_journal_recovers_an_old_log_left_by_a_crash(journal, tmp_path):
+    storage = journal()
+    for book_id in range(1, 4):
+        storage.add_book(None, make_book(f"Book {book_id}", book_id))
+    # A compaction that died after moving the log aside, before writing the snapshot
+    os.link(tmp_path / "library.log", tmp_path / "library.log.old")
+    storage._start_log(storage.generation())
+    storage.remove_books(None, [{"id": 2}])
+
+    reader = journal()
+    assert titles(reader.load()) == ["Book 1", "Book 3"]
+    reader.compact(wait=True)
+    assert not os.path.exists(tmp_path / "library.log.old")
+    assert titles(journal().load()) == ["Book 1", "Book 3"]
@@ -0,0 +1,109 @@
+import base64
+import hashlib
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+
+
+# Default locations and limits for the thumbnail cache
+CACHE_FOLDER = os.path.join("data", "thumb_cache")
+MEMORY_BUDGET_BYTES = 64 * 1024 * 1024
+
+
+# Two-tier cache of cover images encoded as data URIs.
+# Entries are keyed on image path + mtime + size, so a changed file gets a new key
+# and stale entries simply stop being looked up.
+class ThumbnailCache:
+    def __init__(self, cache_folder=CACHE_FOLDER, max_bytes=MEMORY_BUDGET_BYTES):
+        self.cache_folder = cache_folder
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_folder, exist_ok=True)
+
+    # Build the cache key for an image, None if the file is missing
+    def cache_key(self, image_path):
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return None
+        raw = f"{os.path.abspath(image_path)}|{stat.st_mtime_ns}|{stat.st_size}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    # Return the image as a data URI, or "" if it can't be read
+    def get_data_uri(self, image_path):
+        key = self.cache_key(image_path)
+        if key is None:
+            return ""
+
+        with self._lock:
+            data_uri = self._entries.get(key)
+            if data_uri is not None:
+                self._entries.move_to_end(key)
+                return data_uri
+
+        data_uri = self._read_disk(key)
+        if data_uri is None:
+            data_uri = encode_data_uri(image_path)
+            if not data_uri:
+                return ""
+            self._write_disk(key, data_uri)
+
+        self._remember(key, data_uri)
+        return data_uri
+
+    # Drop every in-memory entry (the disk tier is kept)
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_folder, key[:2], f"{key}.txt")
+
+    def _read_disk(self, key):
+        try:
+            with open(self._disk_path(key), "r", encoding="ascii") as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def _write_disk(self, key, data_uri):
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "w", encoding="ascii") as file:
+                file.write(data_uri)
+            os.replace(tmp_path, path)
+        except OSError:
+            # The disk tier is only an optimisation, serving from memory is fine
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _remember(self, key, data_uri):
+        size = len(data_uri)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = data_uri
+            self._size += size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+
+# Read an image file and encode it as a base64 data URI
+def encode_data_uri(image_path):
+    mime_type = mimetypes.guess_type(image_path)[0] or "image/png"
+    try:
+        with open(image_path, "rb") as img_file:
+            encoded = base64.b64encode(img_file.read()).decode()
+    except OSError:
+        return ""
+    return f"data:{mime_type};base64,{encoded}"
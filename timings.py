@@ -0,0 +1,130 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+
+
+# Durations kept per span name for the rolling percentiles
+WINDOW = 500
+PERCENTILES = (50, 90, 99)
+# How often the JSON snapshot file is rewritten, at most
+SNAPSHOT_INTERVAL = 5.0
+
+# One JSON line per finished run goes here. Unless logging is configured already, timing
+# runs send it to stderr at INFO, see _log_runs().
+logger = logging.getLogger("library.timings")
+
+_NO_SPAN = nullcontext()
+
+
+# Times one named phase and records it when the block ends
+class _Span:
+    __slots__ = ("timings", "name", "start")
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timings.record(self.name, time.perf_counter() - self.start)
+
+
+# Process-wide phase timings with rolling percentiles over the last WINDOW runs of each span.
+# Disabled, span() hands back one shared no-op context manager, so instrumented code
+# pays a method call and nothing else.
+class Timings:
+    def __init__(self, enabled=False, window=WINDOW, snapshot_path=None):
+        self.enabled = enabled
+        self.window = window
+        self.snapshot_path = snapshot_path
+        self._lock = threading.Lock()
+        self._durations = {}
+        self._local = threading.local()
+        self._snapshot_written = 0.0
+
+    def span(self, name):
+        return _Span(self, name) if self.enabled else _NO_SPAN
+
+    def record(self, name, seconds):
+        with self._lock:
+            durations = self._durations.get(name)
+            if durations is None:
+                durations = self._durations[name] = deque(maxlen=self.window)
+            durations.append(seconds)
+        run = getattr(self._local, "run", None)
+        if run is not None:
+            run[name] = run.get(name, 0.0) + seconds
+
+    # Start timing a whole script run on this thread, returns a token for finish_run()
+    def start_run(self):
+        if not self.enabled:
+            return None
+        _log_runs()
+        self._local.run = {}
+        return time.perf_counter()
+
+    # Record the run as the span `name`, log its phases as one JSON line and refresh the snapshot file
+    def finish_run(self, name, token):
+        if token is None:
+            return
+        self.record(name, time.perf_counter() - token)
+        run, self._local.run = self._local.run, None
+        logger.info(json.dumps({"page": name, "spans_ms": {span: round(seconds * 1000, 3) for span, seconds in run.items()}}))
+        if self.snapshot_path and self._snapshot_due():
+            self.write_snapshot(self.snapshot_path)
+
+    # Whether SNAPSHOT_INTERVAL passed since the last snapshot, only one of the runs
+    # finishing together gets True
+    def _snapshot_due(self):
+        with self._lock:
+            if time.monotonic() - self._snapshot_written < SNAPSHOT_INTERVAL:
+                return False
+            self._snapshot_written = time.monotonic()
+            return True
+
+    def reset(self):
+        with self._lock:
+            self._durations = {}
+
+    # {span: {"count", "mean_ms", "p50_ms", "p90_ms", "p99_ms", "max_ms"}} over the window
+    def summary(self):
+        with self._lock:
+            samples = {name: sorted(durations) for name, durations in self._durations.items()}
+        summary = {}
+        for name, durations in sorted(samples.items()):
+            stats = {"count": len(durations), "mean_ms": sum(durations) / len(durations) * 1000}
+            for percentile in PERCENTILES:
+                # Nearest-rank percentile
+                rank = max(0, -(-percentile * len(durations) // 100) - 1)
+                stats[f"p{percentile}_ms"] = durations[rank] * 1000
+            stats["max_ms"] = durations[-1] * 1000
+            summary[name] = stats
+        return summary
+
+    def to_json(self):
+        return json.dumps({"enabled": self.enabled, "window": self.window, "spans": self.summary()}, indent=2)
+
+    # Write the summary as JSON, atomically
+    def write_snapshot(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            file.write(self.to_json())
+        os.replace(tmp_path, path)
+
+
+# Without a handler anywhere, or a level below WARNING, the per-run lines would be dropped
+def _log_runs():
+    if not logger.hasHandlers():
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+        logger.addHandler(handler)
+    if logger.level == logging.NOTSET:
+        logger.setLevel(logging.INFO)